@@ -1,5 +1,3 @@
-import os
-
 import math
 import numpy as np
 import matplotlib as mpl
@@ -8,7 +6,8 @@ from matplotlib import rc
 
 from matplotlib.patches import FancyArrowPatch, ArrowStyle
 
-from scipy.optimize import curve_fit
+from mag_pipeline import density, mu_B, load_samples, fit_samples
+from mag_models import MODELS, fit_moments
 
 # rc('text', usetex=True)
 # rc('text.latex',preamble=r'\usepackage[utf8]{inputenc}')
@@ -27,8 +26,6 @@ from matplotlib.ticker import AutoMinorLocator
 ####################################################################################
 ####################################################################################
 
-density = 6.82 # [g/cm^3]
-
 samples = {
    "272": {
       'x': 0,
@@ -41,12 +38,14 @@ samples = {
       'mass': 0.03,
       'data': {},
       'max_y': 0.2,
+      'skip_temps': ['30', '100'],
    },
    "367": {
     'x': 0.1,
       'mass': 0.03,
       'data': {},
       'max_y': 0.5,
+      'skip_temps': ['30'],
    },
    "370": {
       'x': 0.04,
@@ -56,14 +55,6 @@ samples = {
    }
 }
 
-aem = 1.66e-24
-
-m_Fe = 55.845 * aem
-m_Se = 78.96 * aem
-m_Bi = 208.98 * aem
-
-mu_B = 927e-23 # emu
-
 ###################################################################################
 ## Fig setup
 ###################################################################################
@@ -84,26 +75,23 @@ gs = fig.add_gridspec(nrows=3, ncols=1, left=left_margin, right=1-right_margin,
 ##############################################################################################
 ## Load data
 ##############################################################################################
-for num in samples:
-   
-   data_dir = num
-
-   for ind, fname in enumerate(os.listdir(data_dir)):
-
-      temp = fname.split('.')[0].split('=')[1]
-      samples[num]['data'][temp] = np.loadtxt(
-         f"{data_dir}\\{fname}", delimiter='\t').transpose()
-
-      length = len(samples[num]['data'][temp]) # 3 cols in some files, 2 in others
-
-      samples[num]['data'][temp][0] *= 1e-4 # Convert Oe to T
-      samples[num]['data'][temp][length-1] /= samples[num]['mass'] # Calculate moment per unit mass
-      samples[num]['data'][temp][length-1] *= density # Convert to magnetization
-
-      x = float(samples[num]['x'])
-      if x != 0:
-         mu = m_Fe + 2*m_Bi/x + (3+x)*m_Se/x
-         samples[num]['N_Fe'] = samples[num]['mass'] / mu
+# All curves of all samples are read and fitted with a*B + b*tanh(c*B) at once;
+# see mag_pipeline
+load_samples(samples)
+fit_samples(samples)
+
+# Paramagnetic moment of the Fe atoms, fitted jointly over temperatures:
+# 'brillouin' (g = 2), 'langevin' or None. Off by default: the fits of 365,
+# 367 and 370 do not constrain the moment well.
+moment_model = None
+
+if moment_model is not None:
+   fit_moments(samples, moment_model)
+   for num in samples:
+      if 'moment_fit' in samples[num]:
+         fit = samples[num]['moment_fit']
+         print(f"{num}: " + ", ".join(f"{name} = {fit[name]:.3g} +- {fit[name + '_err']:.2g}"
+            for name in MODELS[moment_model][1]))
 
 ##############################################################################################
 ## Configure axes
@@ -185,55 +173,29 @@ ax_367_tw.set_ylim(-per_atom_lim, per_atom_lim)
 ##############################################################################################
 ## Plot data
 ##############################################################################################
-# substract line
-def magnetic_fit(B, a, b, c):
-
-   return a*B + b*np.tanh(c*B)
-
-for temp in sorted(samples["272"]["data"], key=lambda x: int(x)):
-
-   xdata = samples["272"]["data"][temp][0]
-   ydata = samples["272"]["data"][temp][1]
-
-   p0 = (0, 0.1, 1)
-   popt, pcov = curve_fit(magnetic_fit, xdata, ydata, p0=p0)
-
-   ysub = ydata - popt[0]*xdata
-
-   ax_272.scatter(xdata, ysub, s=10, marker='s', lw=2, label=f'$T={temp}$ K')# ec='k', fc='k') 
-   ax_272.plot(xdata, ysub, ls=':', c='k', lw=1)
-
-for temp in sorted(samples["365"]["data"], key=lambda x: int(x)):
-
-   if int(temp) == 30 or int(temp) == 100:
-      continue
-
-   xdata = samples["365"]["data"][temp][0]
-   ydata = samples["365"]["data"][temp][1]
-
-   p0 = (0, 1, 1)
-   popt, pcov = curve_fit(magnetic_fit, xdata, ydata, p0=p0)
-
-   ysub = ydata - popt[0]*xdata
-
-   ax_365.scatter(xdata, ysub, s=10, marker='s', lw=2, label=f'$T={temp}$ K')# ec='k', fc='k') 
-   ax_365.plot(xdata, ysub, ls=':', c='k', lw=1)
-
-for temp in sorted(samples["367"]["data"], key=lambda x: int(x)):
+# magnetization with the linear background a*B substracted
+axes = {'272': ax_272, '365': ax_365, '367': ax_367}
+per_Fe_axes = {'365': ax_365_tw, '367': ax_367_tw}
 
-   if int(temp) == 30:
-      continue
+for num, ax in axes.items():
+   for temp in samples[num]['data']:
 
-   xdata = samples["367"]["data"][temp][0]
-   ydata = samples["367"]["data"][temp][2]
+      if temp in samples[num].get('skip_temps', []):
+         continue
 
-   p0 = (0, 1, 1)
-   popt, pcov = curve_fit(magnetic_fit, xdata, ydata, p0=p0)
+      xdata = samples[num]['data'][temp]['field']
+      ysub = samples[num]['sub'][temp]
 
-   ysub = ydata - popt[0]*xdata
+      ax.scatter(xdata, ysub, s=10, marker='s', lw=2, label=f'$T={temp}$ K')# ec='k', fc='k') 
+      ax.plot(xdata, ysub, ls=':', c='k', lw=1)
 
-   ax_367.scatter(xdata, ysub, s=10, marker='s', lw=2, label=f'$T={temp}$ K')# ec='k', fc='k') 
-   ax_367.plot(xdata, ysub, ls=':', c='k', lw=1)
+      # moment fit, on the per Fe axis
+      if num in per_Fe_axes and 'moment_fit' in samples[num]:
+         fit = samples[num]['moment_fit']
+         func, names = MODELS[fit['model']]
+         B_grid = np.linspace(xdata.min(), xdata.max(), 200)
+         per_Fe_axes[num].plot(B_grid, func(B_grid, float(temp), *[fit[name] for name in names]),
+            ls='--', c='gray', lw=1)
 
 ax_272.legend(loc='lower right', fontsize=15)
 ax_365.legend(loc='lower right', fontsize=15)
@@ -0,0 +1,178 @@
+import numpy as np
+
+from mag_pipeline import stack_curves
+from SdH_func import lm_batch
+
+mu_B_over_k_B = 0.6717 # [K/T]
+g_factor = 2 # of the Fe moments, fixed in the Brillouin fit
+
+##############################################################################################
+## Paramagnetic models
+##############################################################################################
+# Magnetization per Fe atom in mu_B of a fraction conc of Fe atoms carrying
+# moment [mu_B] each, at field B [T] and temperature T [K]:
+#    Brillouin:  conc*moment*B_J(moment*mu_B*B/(k_B*T)), moment = g*J, g = 2
+#    Langevin:   conc*moment*L(moment*mu_B*B/(k_B*T)), the J -> infinity limit
+
+def _coth_minus_inv(x):
+
+   # coth(x) - 1/x, finite at x=0
+   ax = np.abs(x)
+   small = ax < 1e-3
+   ax_safe = np.where(small, 1, ax)
+   val = np.where(small, ax/3 - ax**3/45, 1/np.tanh(ax_safe) - 1/ax_safe)
+   return np.sign(x)*val
+
+def langevin(x):
+
+   return _coth_minus_inv(x)
+
+def brillouin(J, x):
+
+   # B_J(x) = (2J+1)/2J coth((2J+1)x/2J) - 1/2J coth(x/2J), written with
+   # coth(y) - 1/y so that it stays finite at x=0; J broadcasts against x
+   a = (2*J + 1)/(2*J)
+   b = 1/(2*J)
+   return a*_coth_minus_inv(a*x) - b*_coth_minus_inv(b*x)
+
+def brillouin_model(B, T, J, conc):
+
+   moment = g_factor*J
+   return conc*moment*brillouin(J, moment*mu_B_over_k_B*B/T)
+
+def langevin_model(B, T, moment, conc):
+
+   return conc*moment*langevin(moment*mu_B_over_k_B*B/T)
+
+MODELS = {
+   # name: (function, parameter names)
+   'brillouin': (brillouin_model, ('J', 'conc')),
+   'langevin': (langevin_model, ('moment', 'conc')),
+}
+
+##############################################################################################
+## Joint fit over temperatures
+##############################################################################################
+def _num_jac(func, p, rel_step=1e-6):
+
+   # Central differences of func(p) -> (n_sets, n_points) over the columns of p
+   val = func(p)
+   jac = np.empty(val.shape + (p.shape[1],))
+   for ind in range(p.shape[1]):
+      h = rel_step*np.maximum(np.abs(p[:, ind]), 1e-3)
+      dp = np.zeros_like(p)
+      dp[:, ind] = h
+      jac[..., ind] = (func(p + dp) - func(p - dp))/(2*h[:, None])
+   return val, jac
+
+def _grid_init(shape_func, grid, y, valid):
+
+   # For every grid value g the model is conc*shape_func(g), linear in conc:
+   # solve for conc exactly and keep the best g of every set
+   cost, conc = [], []
+   for val in grid:
+      f = np.where(valid, shape_func(val), 0)
+      c = np.sum(f*y, axis=-1)/np.maximum(np.sum(f*f, axis=-1), 1e-300)
+      conc.append(c)
+      cost.append(np.sum((c[:, None]*f - y)**2, axis=-1))
+
+   best = np.argmin(cost, axis=0)
+   return np.asarray(grid)[best], np.array(conc)[best, np.arange(len(y))]
+
+# Bounds of the nonlinear parameter of each model, J of Brillouin and the
+# moment of Langevin. The fit runs in s with the parameter
+# low + (high - low)/(1 + exp(-s)), so the bounds hold without clamping.
+BOUNDS = {
+   'brillouin': (0.5, 50),
+   'langevin': (0, 1e4),
+}
+
+def _to_bounded(s, low, high):
+
+   # Parameter and its derivative over s
+   sig = 1/(1 + np.exp(-s))
+   return low + (high - low)*sig, (high - low)*sig*(1 - sig)
+
+def _to_free(val, low, high):
+
+   return np.log((val - low)/(high - val))
+
+def moment_fit_batch(B, T, y, valid, model='brillouin', bound_tol=1e-3):
+
+   # Fits one model per row of (B, T, y), all points of a row (all
+   # temperatures of a sample) sharing the parameters. Brillouin starts from
+   # the best J on a grid, Langevin from the best moment on a grid.
+   # Returns (popt, pcov) with the parameters of MODELS[model]. The errors of
+   # a fit that ends within bound_tol (relative) of a bound of BOUNDS, or
+   # whose covariance is singular, are NaN: they are not defined there.
+   func, _ = MODELS[model]
+   low, high = BOUNDS[model]
+   y = np.where(valid, y, 0)
+   T = np.where(valid, T, 1)
+
+   if model == 'brillouin':
+      grid = np.arange(2, 41)/2
+   else:
+      grid = np.logspace(0, 3, 31)
+   val, conc = _grid_init(lambda val: func(B, T, val, 1), grid, y, valid)
+   p0 = np.stack([_to_free(val, low, high), conc], axis=-1)
+
+   def model_func(p):
+      return _num_jac(lambda p: func(B, T, _to_bounded(p[:, :1], low, high)[0], p[:, 1:]), p)
+
+   popt, pcov = lm_batch(model_func, p0, np.where(valid, y, np.nan), valid)
+
+   # Back to the bounded parameter, covariance through the derivative
+   val, deriv = _to_bounded(popt[:, 0], low, high)
+   scale = np.stack([deriv, np.ones_like(deriv)], axis=-1)
+   pcov = pcov*scale[:, :, None]*scale[:, None, :]
+   popt[:, 0] = val
+
+   # Singular: the correlation matrix, free of the parameter scales, is
+   # ill-conditioned or a variance is not positive
+   on_bound = (val - low < bound_tol*(high - low)) | (high - val < bound_tol*(high - low))
+   with np.errstate(divide='ignore', invalid='ignore'):
+      sigma = np.sqrt(np.diagonal(pcov, axis1=1, axis2=2))
+      corr = pcov/(sigma[:, :, None]*sigma[:, None, :])
+      singular = ~np.all(sigma > 0, axis=-1) | ~(np.linalg.cond(np.nan_to_num(corr)) < 1e8)
+   pcov[on_bound | singular] = np.nan
+   return popt, pcov
+
+def fit_moments(samples, model='brillouin', nums=None):
+
+   # Joint fit of the 'per_Fe' curves of fit_samples over all temperatures not
+   # in skip_temps, one row per sample, all samples in one call. The field of
+   # a point is taken from the data, its temperature from the temperature
+   # column where the file has one. Adds samples[num]['moment_fit'] =
+   # {'model', <parameter>: value, <parameter>_err: error, 'cov'}, errors NaN
+   # for a fit on a bound of BOUNDS or a degenerate one.
+   if nums is None:
+      nums = [num for num in samples if samples[num].get('per_Fe')]
+
+   curves = []
+   for num in nums:
+      temps = [temp for temp in samples[num]['per_Fe']
+         if temp not in samples[num].get('skip_temps', [])]
+      data = [samples[num]['data'][temp] for temp in temps]
+      curves.append({
+         'field': np.concatenate([curve['field'] for curve in data]),
+         'magn': np.concatenate([samples[num]['per_Fe'][temp] for temp in temps]),
+         'temp': np.concatenate([curve.get('temp', np.full(len(curve['field']), float(temp)))
+            for temp, curve in zip(temps, data)]),
+      })
+
+   B, y, valid = stack_curves(curves)
+   T = np.ones_like(B)
+   for ind, curve in enumerate(curves):
+      T[ind, :len(curve['temp'])] = curve['temp']
+
+   popt, pcov = moment_fit_batch(B, T, y, valid, model)
+
+   _, names = MODELS[model]
+   for ind, num in enumerate(nums):
+      samples[num]['moment_fit'] = {'model': model, 'cov': pcov[ind]}
+      samples[num]['moment_fit'].update(zip(names, popt[ind]))
+      samples[num]['moment_fit'].update((name + '_err', err)
+         for name, err in zip(names, np.sqrt(np.diagonal(pcov[ind]))))
+
+   return samples
@@ -0,0 +1,152 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Transport'))
+from dat_cache import load_dat
+from SdH_func import lm_batch
+
+density = 6.82 # [g/cm^3]
+
+aem = 1.66e-24
+
+m_Fe = 55.845 * aem
+m_Se = 78.96 * aem
+m_Bi = 208.98 * aem
+
+mu_B = 927e-23 # emu
+
+# Columns of the magnetometer files by their count: field [Oe], (sample
+# temperature [K],) magnetic moment [emu]
+SCHEMAS = {
+   2: ('field', 'moment'),
+   3: ('field', 'temp', 'moment'),
+}
+
+##############################################################################################
+## Loading
+##############################################################################################
+def read_curve(fname):
+
+   # {column: array} of one T=*.dat file, in the units of the file
+   raw = load_dat(fname, delimiter='\t').transpose()
+   if len(raw) not in SCHEMAS:
+      raise ValueError(f"{fname}: {len(raw)} columns, known layouts: {SCHEMAS}")
+   return {name: np.array(col) for name, col in zip(SCHEMAS[len(raw)], raw)}
+
+def load_samples(samples, data_root='.'):
+
+   # Fills samples[num]['data'][temp] with {'field' [T], 'magn' [10^3 A/m],
+   # ...} for all Magnetism/<num>/T=*.dat, temperatures in increasing order,
+   # and samples[num]['N_Fe'] for doped samples
+   for num in samples:
+
+      data_dir = os.path.join(data_root, num)
+      fnames = sorted(os.listdir(data_dir), key=lambda fname: float(fname[2:-4]))
+      for fname in fnames:
+
+         curve = read_curve(os.path.join(data_dir, fname))
+         curve['field'] = curve['field']*1e-4 # Convert Oe to T
+         # moment per unit mass, converted to magnetization
+         curve['magn'] = curve.pop('moment')/samples[num]['mass']*density
+         samples[num]['data'][fname[2:-4]] = curve
+
+      x = float(samples[num]['x'])
+      if x != 0:
+         mu = m_Fe + 2*m_Bi/x + (3+x)*m_Se/x
+         samples[num]['N_Fe'] = samples[num]['mass'] / mu
+
+   return samples
+
+##############################################################################################
+## Fitting
+##############################################################################################
+def magnetic_fit(B, a, b, c):
+
+   # Linear background plus saturating paramagnetic term
+   return a*B + b*np.tanh(c*B)
+
+def stack_curves(curves):
+
+   # (B, M, valid) arrays of shape (n_curves, max_len), padded with zeros
+   size = max(len(curve['field']) for curve in curves)
+   B = np.zeros((len(curves), size))
+   M = np.zeros((len(curves), size))
+   valid = np.zeros((len(curves), size), dtype=bool)
+   for ind, curve in enumerate(curves):
+      n = len(curve['field'])
+      B[ind, :n], M[ind, :n], valid[ind, :n] = curve['field'], curve['magn'], True
+   return B, M, valid
+
+def tanh_init(B, M, valid):
+
+   # Start values: the best c on a log grid, with a and b solved for exactly
+   c_grid = np.logspace(-2, 2, 41)
+   t = np.tanh(c_grid[:, None, None]*B)*valid
+
+   # 2x2 normal equations of (a, b) for every curve and c
+   sBB, sBM = np.sum(B*B*valid, axis=-1), np.sum(B*M*valid, axis=-1)
+   stt, stB, stM = np.sum(t*t, axis=-1), np.sum(t*B, axis=-1), np.sum(t*M, axis=-1)
+   det = sBB*stt - stB**2
+   with np.errstate(divide='ignore', invalid='ignore'):
+      a = (stt*sBM - stB*stM)/det
+      b = (sBB*stM - stB*sBM)/det
+   cost = np.sum(((a[..., None]*B + b[..., None]*t - M)*valid)**2, axis=-1)
+   best = np.argmin(np.where(np.isfinite(cost), cost, np.inf), axis=0)
+
+   cols = np.arange(len(B))
+   return np.stack([a[best, cols], b[best, cols], c_grid[best]], axis=-1)
+
+def tanh_fit_batch(B, M, valid, p0=None):
+
+   # Fits magnetic_fit to every row of B, M at once. Rows of p0 that are
+   # missing or NaN start from tanh_init. Returns (popt, pcov).
+   p0 = np.full((len(B), 3), np.nan) if p0 is None else np.array(p0, dtype=float)
+   missing = np.isnan(p0).any(axis=1)
+   if missing.any():
+      p0[missing] = tanh_init(B[missing], M[missing], valid[missing])
+
+   def model(p):
+      a, b, c = p[:, 0, None], p[:, 1, None], p[:, 2, None]
+      t = np.tanh(c*B)
+      return a*B + b*t, np.stack([B, t, b*B*(1 - t**2)], axis=-1)
+
+   return lm_batch(model, p0, np.where(valid, M, np.nan), valid)
+
+def fit_samples(samples):
+
+   # Fits all (sample, T) curves, one tanh_fit_batch call per temperature
+   # rank: the n-th temperature of every sample starts from the fit of its
+   # (n-1)-th. Adds per sample 'fit' (a, b, c), 'sub' (magnetization minus
+   # a*B) and 'per_Fe' (sub in mu_B per Fe atom, doped samples only).
+   nums = list(samples)
+   temps = {num: list(samples[num]['data']) for num in nums}
+   n_ranks = max(len(temps[num]) for num in nums)
+
+   for num in nums:
+      samples[num]['fit'], samples[num]['sub'], samples[num]['per_Fe'] = {}, {}, {}
+
+   prev = {}
+   for rank in range(n_ranks):
+
+      keys = [(num, temps[num][rank]) for num in nums if rank < len(temps[num])]
+      B, M, valid = stack_curves([samples[num]['data'][temp] for num, temp in keys])
+
+      popt, _ = tanh_fit_batch(B, M, valid,
+         p0=[prev.get(num, [np.nan]*3) for num, _ in keys])
+
+      # Background subtraction and per Fe conversion in bulk
+      sub = M - popt[:, 0, None]*B
+      per_Fe = np.array([samples[num]['mass']/(density*mu_B*samples[num]['N_Fe'])
+         if 'N_Fe' in samples[num] else np.nan for num, _ in keys])[:, None]*sub
+
+      for ind, (num, temp) in enumerate(keys):
+         n = np.sum(valid[ind])
+         samples[num]['fit'][temp] = popt[ind]
+         samples[num]['sub'][temp] = sub[ind, :n]
+         if 'N_Fe' in samples[num]:
+            samples[num]['per_Fe'][temp] = per_Fe[ind, :n]
+         prev[num] = popt[ind]
+
+   return samples
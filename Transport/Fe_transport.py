@@ -1,4 +1,5 @@
 import math
+import os
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
@@ -6,6 +7,11 @@ from matplotlib import rc
 
 from matplotlib.patches import FancyArrowPatch, ArrowStyle
 
+from dat_cache import load_dat
+from SdH_func import epsilon, symmetrize_batch
+from SdH_results import ResultStore
+from SdH_plots import plot_curve
+
 # rc('text', usetex=True)
 # rc('text.latex',preamble=r'\usepackage[utf8]{inputenc}')
 # rc('text.latex',preamble=r'\usepackage[russian]{babel}')
@@ -17,32 +23,6 @@ visible_ticks = {
 
 from matplotlib.ticker import AutoMinorLocator
 
-def symmetrize(field, volts, sym=True):
-
-	isort = np.argsort(field)
-	field, volts = field[isort], volts[isort]
-
-	field_range = max(field) - min(field)
-	min_field = min(field) + 1e-3*field_range
-	max_field = max(field) - 1e-3*field_range
-	grid_max = min(abs(min_field), max_field)
-
-	field_grid = np.linspace(-grid_max, grid_max, 1000)
-	volts_int = np.interp(field_grid, field, volts)
-
-	if sym:
-		volts_sym = 0.5*(volts_int[:] + volts_int[::-1])
-	else:
-		volts_sym = 0.5*(volts_int[:] - volts_int[::-1])
-
-	return np.array([field_grid, volts_sym])
-
-def epsilon(field, volts):
-	
-	ind = np.argmin(np.abs(field))
-	return volts/volts[ind]-1
-
-
 ####################################################################################
 ####################################################################################
 ### Fe_samples
@@ -89,16 +69,16 @@ ax_sdh = fig.add_subplot(gs[:, 2:])
 ax_sdh.annotate('(c)', xy=(0.025, 1.025), xycoords='axes fraction', fontsize=20)
 
 # Load data
-RB_272 = np.transpose(np.loadtxt("RB_curves\\272.dat"))
-RB_367 = np.transpose(np.loadtxt("RB_curves\\367.dat"))
-RB_363 = np.transpose(np.loadtxt("RB_curves\\363.dat"))
-RB_366 = np.transpose(np.loadtxt("RB_curves\\366.dat"))
+RB_272 = np.transpose(load_dat(os.path.join("RB_curves", "272.dat")))
+RB_367 = np.transpose(load_dat(os.path.join("RB_curves", "367.dat")))
+RB_363 = np.transpose(load_dat(os.path.join("RB_curves", "363.dat")))
+RB_366 = np.transpose(load_dat(os.path.join("RB_curves", "366.dat")))
 
-# Symmetrize some curves
-RB_272_x = symmetrize(RB_272[2], RB_272[1], sym=True)
-RB_363_x = symmetrize(RB_363[0], RB_363[1], sym=True)
-RB_366_x = symmetrize(RB_366[0], RB_366[1], sym=True)
-RB_367_x = symmetrize(RB_367[0], RB_367[1], sym=True)
+# Symmetrize every curve on a grid as dense as its own data: one batch for
+# all would put the ~5k point 363 and 366 curves on the ~80k grid of 272
+RB_272_x, RB_363_x, RB_366_x, RB_367_x = [symmetrize_batch([field], [volts])[:2, 0]
+	for field, volts in [(RB_272[2], RB_272[1]), (RB_363[0], RB_363[1]),
+		(RB_366[0], RB_366[1]), (RB_367[0], RB_367[1])]]
 
 # Scale curves
 RB_272_x[1] = epsilon(*RB_272_x)
@@ -122,10 +102,10 @@ ax_sdh.tick_params(axis='both', which='major', direction='in', width=2, length=1
 ax_sdh.tick_params(axis='both', which='minor', direction='in', width=1.5, length=6, labelsize=8, **visible_ticks)
 # ax_sdh.tick_params(axis='y', which='major', direction='in', width=1.5, length=6, labelsize=0, **visible_ticks)
 
-ax_sdh.plot(RB_272_x[0], RB_272_x[1], c='k', lw=1.5, label='x=0')
-ax_sdh.plot(RB_366_x[0], RB_366_x[1], c='navy', lw=1.5, label='x=0.002')
-ax_sdh.plot(RB_363_x[0], RB_363_x[1], c='teal', lw=1.5, label='x=0.005')
-ax_sdh.plot(RB_367_x[0], RB_367_x[1], c='olive', lw=1.5, label='x=0.1')
+plot_curve(ax_sdh, RB_272_x[0], RB_272_x[1], c='k', lw=1.5, label='x=0')
+plot_curve(ax_sdh, RB_366_x[0], RB_366_x[1], c='navy', lw=1.5, label='x=0.002')
+plot_curve(ax_sdh, RB_363_x[0], RB_363_x[1], c='teal', lw=1.5, label='x=0.005')
+plot_curve(ax_sdh, RB_367_x[0], RB_367_x[1], c='olive', lw=1.5, label='x=0.1')
 
 ax_sdh.legend(loc='upper left', fontsize=15)
 
@@ -137,10 +117,10 @@ ax_rt = fig.add_subplot(gs[0, 0:2])
 ax_rt.annotate('(a)', xy=(0.05, 1.05), xycoords='axes fraction', fontsize=20)
 
 # Load data
-RT_272 = np.transpose(np.loadtxt("RT_curves\\272.dat"))
-RT_366 = np.transpose(np.loadtxt("RT_curves\\366.dat"))
-RT_367 = np.transpose(np.loadtxt("RT_curves\\367.dat"))
-RT_371 = np.transpose(np.loadtxt("RT_curves\\371.dat"))
+RT_272 = np.transpose(load_dat(os.path.join("RT_curves", "272.dat")))
+RT_366 = np.transpose(load_dat(os.path.join("RT_curves", "366.dat")))
+RT_367 = np.transpose(load_dat(os.path.join("RT_curves", "367.dat")))
+RT_371 = np.transpose(load_dat(os.path.join("RT_curves", "371.dat")))
 
 # Setup axis
 x_minor_locator = AutoMinorLocator(5)
@@ -158,10 +138,10 @@ ax_rt.tick_params(axis='both', which='major', direction='in',
 ax_rt.tick_params(axis='both', which='minor', direction='in',
 	width=1.5, length=6, labelsize=8, **visible_ticks)
 
-ax_rt.plot(RT_272[0], RT_272[1], c='k', label='x=0', lw=2)
-ax_rt.plot(RT_366[0], RT_366[1], c='navy', label='x=0.002', lw=2)
-ax_rt.plot(RT_367[0], RT_367[1], c='olive', label='x=0.1', lw=2)
-ax_rt.plot(RT_371[0], RT_371[1], c='red', label='x=0.15', lw=2)
+plot_curve(ax_rt, RT_272[0], RT_272[1], c='k', label='x=0', lw=2)
+plot_curve(ax_rt, RT_366[0], RT_366[1], c='navy', label='x=0.002', lw=2)
+plot_curve(ax_rt, RT_367[0], RT_367[1], c='olive', label='x=0.1', lw=2)
+plot_curve(ax_rt, RT_371[0], RT_371[1], c='red', label='x=0.15', lw=2)
 
 ax_rt.legend(loc='upper left', fontsize=15)
 
@@ -212,6 +192,13 @@ ax_mu.set_yticks([0, 1, 2.5, 5, 10])
 ax_mu.scatter(X, 1e-3*mu, s=100, marker='^', c='r') 
 ax_mu.plot(X, 1e-3*mu, ls='--', c='r', lw=1)
 
+# Quantum mobilities stored by SdH_main.py, without refitting: run SdH_main.py
+# first (render_figures.py does), the panel shows what it stored last
+sdh = ResultStore("SdH_results.json").table('sample', 'mu_q', temp=None)
+X_sdh = np.array([Fe_samples[num][0] for num in sdh['sample'] if num in Fe_samples])
+mu_sdh = np.array([mu_q for num, mu_q in zip(sdh['sample'], sdh['mu_q']) if num in Fe_samples])
+ax_mu.scatter(X_sdh, 1e-3*mu_sdh, s=100, marker='^', ec='r', fc='none')
+
 # ax_mu.annotate('', xy=(0.16, 2), xytext=(0.07, 2), arrowprops=dict(facecolor='black', shrink=0.05))
 
 fig.tight_layout()
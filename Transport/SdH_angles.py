@@ -0,0 +1,236 @@
+import os
+
+import numpy as np
+from scipy.signal import savgol_filter
+
+from dat_cache import cache_paths, write_atomic
+from parallel import run_jobs
+from raw_data import read_header, read_columns
+from SdH_func import find_freq_peaks, osc_spectrum, symmetrize
+from SdH_results import ResultStore
+
+#########################################################################################
+### Angle-resolved measurements
+#########################################################################################
+# The logs of SdH_raw_data/<num>/data/var_theta and phi-sweeps have an 'angle'
+# column of the rotator and an 'is_rotating' flag. Rows at rest are R(H) sweeps
+# at a fixed angle, rotating rows are phi-sweeps at a fixed |B|.
+# Rotator calibration (SdH_raw_data/367/README.txt): 177 -- field perpendicular
+# to the film, 268 -- field in the film plane.
+ANGLE_PERP = 177
+ANGLE_INPLANE = 268
+
+LOG_COLUMNS = ('angle', 'is_rotating', 'Magnet_magnet_field', 'Tsample')
+
+# Parameters the grouping of a log depends on
+GROUP_KEYS = ('channel', 'temp', 'temp_tol', 'angle_step')
+
+angle_params = {
+   "367": {
+      'data_dir': os.path.join("..", "SdH_raw_data", "367", "data"),
+      'dirs': ["var_theta", "phi-sweeps"],
+      'channel': 'V_367-x_X', # R_xx of 367-a
+      'temp': 3,
+      'temp_tol': 0.5,
+      'angle_step': 0.5, # rest angles closer than that are one angle
+      'min_field': 7,
+      'max_field': 15.6,
+      'min_span': 2, # shortest usable field range
+      'n_points': 4000,
+      'window_length': 51,
+      'polyorder': 1,
+      'deriv': 1,
+      'n_peaks': 3,
+      'min_freq': 20,
+   },
+}
+
+def theta(angle):
+
+   # Angle between the field and the film normal [deg]
+   return 90*(np.asarray(angle) - ANGLE_PERP)/(ANGLE_INPLANE - ANGLE_PERP)
+
+#########################################################################################
+### Grouping
+#########################################################################################
+def log_files(params):
+
+   # .txt logs of params['dirs'], listed without opening them
+   fnames = []
+   for data_dir in params['dirs']:
+      data_dir = os.path.join(params['data_dir'], data_dir)
+      fnames += [os.path.join(data_dir, fname) for fname in sorted(os.listdir(data_dir))
+         if fname.endswith('.txt')]
+   return fnames
+
+def log_segments(fname, params):
+
+   # [(label, kind, angle, field, volts)] of the rows of one log at
+   # params['temp'], [] if the log lacks the angle or the measured channel.
+   # kind 'field' -- R(H) at rest, one label per angle; kind 'rotation' --
+   # phi-sweeps, one label per field sign, field is B*cos(theta).
+   columns = LOG_COLUMNS + (params['channel'],)
+   if not all(col in read_header(fname) for col in columns):
+      return []
+
+   log = read_columns(fname, columns)
+   at_temp = np.abs(log['Tsample'] - params['temp']) < params['temp_tol']
+   field, volts = log['Magnet_magnet_field'], log[params['channel']]
+   segments = []
+
+   rest = at_temp & (log['is_rotating'] == 0)
+   angles = np.round(log['angle'][rest]/params['angle_step'])*params['angle_step']
+   for angle in np.unique(angles):
+      ind = np.flatnonzero(rest)[angles == angle]
+      if np.ptp(field[ind]) > 0:
+         segments.append((f"theta={theta(angle):.1f}", 'field', angle, field[ind], volts[ind]))
+
+   rot = at_temp & (log['is_rotating'] == 1)
+   for sign in (-1, 1):
+      ind = np.flatnonzero(rot & (np.sign(field) == sign))
+      if len(ind) > 1:
+         b_perp = np.abs(field[ind]*np.cos(np.radians(theta(log['angle'][ind]))))
+         segments.append((f"rotation B{sign:+d}", 'rotation', np.nan, b_perp, volts[ind]))
+
+   return segments
+
+def cached_segments(fname, params, store):
+
+   # log_segments kept in the data cache next to the log (see dat_cache),
+   # under the key of the log contents and GROUP_KEYS. Only logs that are
+   # new or changed since the last run are read.
+   key = store.key([fname], {name: params[name] for name in GROUP_KEYS})
+   path = cache_paths(fname)[0][:-len(".npy")] + ".angles.npz"
+   try:
+      with np.load(path) as cached:
+         if str(cached['key']) == key:
+            return [(str(label), str(kind), float(angle), cached[f"field_{ind}"],
+               cached[f"volts_{ind}"]) for ind, (label, kind, angle)
+               in enumerate(zip(cached['labels'], cached['kinds'], cached['angles']))]
+   except (OSError, KeyError, ValueError):
+      pass
+
+   segments = log_segments(fname, params)
+   arrays = {'key': key,
+      'labels': np.array([seg[0] for seg in segments], dtype=str),
+      'kinds': np.array([seg[1] for seg in segments], dtype=str),
+      'angles': np.array([seg[2] for seg in segments], dtype=float)}
+   for ind, seg in enumerate(segments):
+      arrays[f"field_{ind}"], arrays[f"volts_{ind}"] = seg[3], seg[4]
+
+   os.makedirs(os.path.dirname(path), exist_ok=True)
+   write_atomic(path, lambda f: np.savez(f, **arrays), mode='wb')
+   return segments
+
+def group_logs(fnames, params, store):
+
+   # {label: (kind, angle, [(fname, field, volts)])} of the rows at
+   # params['temp'] over all logs, from the cached segments of every log
+   groups = {}
+   for fname in fnames:
+      for label, kind, angle, field, volts in cached_segments(fname, params, store):
+         groups.setdefault(label, (kind, angle, []))[2].append((fname, field, volts))
+   return groups
+
+#########################################################################################
+### Processing
+#########################################################################################
+def angle_curve(field, volts, params):
+
+   # Filtered curve on a uniform |B| grid over [min_field, max_field], as
+   # (grid, curve), or None if the data cover less than min_span. The
+   # symmetric part is used when both field signs cover the range.
+   neg, pos = -np.min(field, initial=0), np.max(field, initial=0)
+   if min(neg, pos) > params['min_field'] + params['min_span']:
+      field, volts = symmetrize(field, volts)
+   else:
+      field = np.abs(field)
+
+   lo, hi = max(params['min_field'], field.min()), min(params['max_field'], field.max())
+   if hi - lo < params['min_span']:
+      return None
+
+   isort = np.argsort(field)
+   grid = np.linspace(lo, hi, params['n_points'])
+   curve = np.interp(grid, field[isort], volts[isort])
+   curve = savgol_filter(curve/curve.mean() - 1, params['window_length'],
+      params['polyorder'], params['deriv'])
+   return grid, curve
+
+def _angle_job(job):
+
+   # symmetrize -> filter -> frequency peaks of one group
+   label, segments, params = job
+   field = np.concatenate([seg[1] for seg in segments])
+   volts = np.concatenate([seg[2] for seg in segments])
+
+   result = angle_curve(field, volts, params)
+   if result is None:
+      return label, None
+   grid, curve = result
+
+   freqs, spectra = osc_spectrum([grid], [curve])
+   peak_freqs, peak_amps = find_freq_peaks(freqs, spectra, params['n_peaks'], params['min_freq'])
+   return label, {
+      'F': peak_freqs[0],
+      'amp': peak_amps[0],
+      'field_range': [grid[0], grid[-1]],
+   }
+
+def run_angles(params_all=angle_params, store=None, n_workers=1):
+
+   # Processes every angle group of every sample in parallel and keeps the
+   # results in store, one row per (sample, group) with kind, angle, theta,
+   # F and amp (n_peaks strongest peaks). A group is reprocessed only when
+   # its files or the parameters change, so a new angle costs one job.
+   store = ResultStore("SdH_angles.json") if store is None else store
+
+   jobs, rows = [], {}
+   for num, params in params_all.items():
+      for label, (kind, angle, segments) in group_logs(log_files(params), params, store).items():
+
+         fnames = sorted({seg[0] for seg in segments})
+         key = store.key(fnames, dict(params, group=label))
+         row = store.row(key, num, label)
+         row.update(kind=kind, angle=angle, theta=theta(angle))
+         if 'F' not in row and not row.get('empty'):
+            jobs.append((label, segments, params))
+            rows[(num, label)] = row
+
+   for (num, label), (_, result) in zip(rows, run_jobs(_angle_job, jobs, n_workers)):
+      if result is None:
+         rows[(num, label)]['empty'] = True
+      else:
+         rows[(num, label)].update(result)
+
+   store.save()
+   return store
+
+def angle_maps(store, num):
+
+   # theta, F(theta), amp(theta) of the R(H) sweeps, (n_angles, n_peaks),
+   # in increasing theta
+   table = store.table('theta', 'F', 'amp', sample=num, kind='field')
+   order = np.argsort(table['theta'])
+   return table['theta'][order], table['F'][order], table['amp'][order]
+
+def scaling_2d(theta_deg, F):
+
+   # F*cos(theta): constant for a 2-D Fermi surface
+   return F*np.cos(np.radians(theta_deg))[:, None]
+
+if __name__ == '__main__':
+
+   store = run_angles(n_workers=os.cpu_count())
+   for num in angle_params:
+
+      thetas, F, amp = angle_maps(store, num)
+      for th, freqs, amps, F_perp in zip(thetas, F, amp, scaling_2d(thetas, F)):
+         print(f"{num}: theta = {th:5.1f}, F = {freqs[0]:6.1f} T (amplitude {amps[0]:.2e}), "
+            f"F cos(theta) = {F_perp[0]:6.1f} T")
+
+      # At a fixed |B| the phase of the oscillation follows B cos(theta) for
+      # a 2-D Fermi surface, so the rotation spectra peak at F(theta=0)
+      rot = store.table('sample', 'F', sample=num, kind='rotation')
+      for freqs in rot['F']:
+         print(f"{num}: rotation at fixed |B|, F over B cos(theta) = {freqs[0]:6.1f} T")
@@ -0,0 +1,205 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.signal import savgol_filter
+
+from SdH_filters import rolling_median
+from SdH_func import (
+   m_0,
+   epsilon,
+   moving_average,
+   symmetrize,
+   symmetrize_batch,
+   find_extr_batch,
+   osc_spectrum,
+   LC_func,
+   LC_global_fit,
+   RT_fit,
+   RT_fit_batch,
+)
+
+# Parameters of the synthetic sample, close to sample 367
+LK_PARAMS = {
+   'amp': 2e-3,
+   'm_c': 0.3*m_0,
+   'T_D': 10,
+   'f': 264.5,
+   'ph': 0.7,
+}
+TEMPS = [3, 6, 10, 15]
+BG_COEFFS = [2e-4, 0, 5e-3, 0, 1] # rho(B)/rho(0) background, highest power first
+NOISE = 1e-5
+MIN_FIELD, MAX_FIELD = 7, 15.6
+
+# Largest size run for a stage; the joint LK fit builds a dense Jacobian
+STAGE_MAX_SIZE = {
+   'LC_global_fit': 1_000_000,
+}
+
+#########################################################################################
+### Synthetic data
+#########################################################################################
+def synthetic_RB(n_points, temp, seed=0, max_field=16, lk_params=LK_PARAMS):
+
+   # Field sweep from -max_field to max_field with a jittered (not monotonic)
+   # field, polynomial background, LK oscillations from R_T/R_D/osc and noise
+   rng = np.random.default_rng(seed)
+   field = np.linspace(-max_field, max_field, n_points)
+   field += rng.normal(scale=0.2*2*max_field/n_points, size=n_points)
+
+   # LK term is negligible below 1 T, avoid the 1/B singularity there
+   abs_field = np.maximum(np.abs(field), 1)
+   lk = LC_func(abs_field, temp, *lk_params.values())*(np.abs(field) > 1)
+
+   volts = np.polyval(BG_COEFFS, field) + lk + rng.normal(scale=NOISE, size=n_points)
+   return field, volts
+
+def synthetic_osc(n_points, temps=TEMPS, lk_params=LK_PARAMS):
+
+   # Oscillating part only, as after filtering and trimming: one curve per
+   # temperature on the MIN_FIELD..MAX_FIELD grid
+   field = np.linspace(MIN_FIELD, MAX_FIELD, n_points)
+   rng = np.random.default_rng(1)
+   return field, [LC_func(field, temp, *lk_params.values())
+      + rng.normal(scale=0.05*lk_params['amp'], size=n_points) for temp in temps]
+
+#########################################################################################
+### Stages
+#########################################################################################
+def expected_extrs(kind, lk_params=LK_PARAMS):
+
+   # Positions of the maxima (kind='maxs') or minima in 1/B inside the trim range
+   f, ph = lk_params['f'], lk_params['ph']
+   shift = 0 if kind == 'maxs' else 0.5
+   k = np.arange(np.ceil(f/MAX_FIELD + ph/(2*np.pi) - shift) + 1,
+      np.floor(f/MIN_FIELD + ph/(2*np.pi) - shift))
+   return (k + shift - ph/(2*np.pi))/f
+
+def make_stages(n_points):
+
+   # name -> (setup, run, points processed); setup builds the inputs outside
+   # of the timed region
+   def raw():
+      field, volts = synthetic_RB(n_points, TEMPS[0])
+      return field, epsilon(field, volts)
+
+   def osc():
+      return synthetic_osc(n_points)
+
+   def extr_amps():
+      field, curves = synthetic_osc(n_points)
+      _, amps = find_extr_batch([1/field]*len(curves), curves, expected_extrs('maxs'))
+      return field, curves, amps
+
+   def run_extr(data):
+      field, curves = data
+      find_extr_batch([1/field]*len(curves), curves, expected_extrs('mins'))
+      find_extr_batch([1/field]*len(curves), curves, expected_extrs('maxs'))
+
+   def run_RT_fit(data):
+      field, curves, amps = data
+      B = 1/expected_extrs('maxs')[0]
+      RT_fit(np.array(TEMPS, dtype=float), amps[:, 0], B,
+         p0=(LK_PARAMS['amp'], LK_PARAMS['m_c']))
+
+   def run_RT_fit_batch(data):
+      field, curves, amps = data
+      RT_fit_batch(TEMPS, amps.transpose(), 1/expected_extrs('maxs'))
+
+   def run_LC_fit(data):
+      field, curves = data
+      p0 = list(LK_PARAMS.values())
+      p0[1] *= 1.2
+      LC_global_fit([field]*len(curves), curves, TEMPS, p0)
+
+   n_osc = n_points*len(TEMPS)
+   return {
+      'symmetrize': (raw, lambda data: symmetrize(*data), n_points),
+      'symmetrize_batch': (raw, lambda data: symmetrize_batch([data[0]], [data[1]]), n_points),
+      'moving_average': (raw, lambda data: moving_average(data[1], 50), n_points),
+      'rolling_median': (raw, lambda data: rolling_median(data[1], 51, chunk_size=1000000), n_points),
+      'savgol_filter': (raw, lambda data: savgol_filter(data[1], 51, 1, 1), n_points),
+      'find_extr': (osc, run_extr, n_osc),
+      'spectrum': (osc, lambda data: osc_spectrum([data[0]]*len(TEMPS), data[1]), n_osc),
+      'RT_fit': (extr_amps, run_RT_fit, len(TEMPS)),
+      'RT_fit_batch': (extr_amps, run_RT_fit_batch, len(TEMPS)*len(expected_extrs('maxs'))),
+      'LC_global_fit': (osc, run_LC_fit, n_osc),
+   }
+
+#########################################################################################
+### Benchmark
+#########################################################################################
+def time_stage(setup, run, repeat):
+
+   data = setup()
+
+   # Peak memory of one run on top of the inputs
+   tracemalloc.start()
+   run(data)
+   _, peak = tracemalloc.get_traced_memory()
+   tracemalloc.stop()
+
+   times = []
+   for _ in range(repeat):
+      start = time.perf_counter()
+      run(data)
+      times.append(time.perf_counter() - start)
+
+   return min(times), peak
+
+def git_commit():
+
+   try:
+      return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+         text=True, check=True).stdout.strip()
+   except (OSError, subprocess.CalledProcessError):
+      return None
+
+def run_bench(sizes, stages=None, repeat=3):
+
+   results = []
+   for n_points in sizes:
+      for name, (setup, run, points) in make_stages(n_points).items():
+
+         if stages is not None and name not in stages:
+            continue
+         if n_points > STAGE_MAX_SIZE.get(name, n_points):
+            continue
+
+         seconds, peak = time_stage(setup, run, repeat)
+         results.append({
+            'stage': name,
+            'size': n_points,
+            'points': points,
+            'seconds': seconds,
+            'points_per_s': points/seconds if seconds > 0 else None,
+            'peak_memory_bytes': peak,
+         })
+         print(f"{name:>18} {n_points:>10}: {seconds:.4f} s, {peak/2**20:.1f} MiB", flush=True)
+
+   return {
+      'commit': git_commit(),
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+      'repeat': repeat,
+      'results': results,
+   }
+
+if __name__ == '__main__':
+
+   parser = argparse.ArgumentParser(description="Time the SdH analysis stages on synthetic data")
+   parser.add_argument('--sizes', type=int, nargs='+',
+      default=[10_000, 100_000, 1_000_000, 10_000_000])
+   parser.add_argument('--stages', nargs='+', default=None)
+   parser.add_argument('--repeat', type=int, default=3)
+   parser.add_argument('--output', default='bench_output.json')
+   args = parser.parse_args()
+
+   report = run_bench(args.sizes, args.stages, args.repeat)
+   with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
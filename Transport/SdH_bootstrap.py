@@ -0,0 +1,169 @@
+import numpy as np
+from scipy.signal import savgol_filter
+
+from SdH_func import (
+   hbar,
+   k_B,
+   q,
+   R_T,
+   RT_fit_batch,
+   find_extr_batch,
+)
+from parallel import run_jobs
+
+# Quantities estimated from the extremum amplitudes of a sample
+BOOT_KEYS = ('amp', 'm_c', 'T_D', 'tau_q', 'mu_q')
+
+#########################################################################################
+### Estimates
+#########################################################################################
+def sdh_estimates(temps, max_amps, maxs, fields, osc_ind, dingle_ind, weights=None):
+
+   # The chain of SdH_main for n_rep replicates at once. max_amps, maxs --
+   # (n_rep, n_temps, n_extr); fields -- (n_extr,) fields of the R_T fits;
+   # osc_ind -- extremums of the R_T fit; dingle_ind -- temperature of the
+   # Dingle plot; weights -- (n_rep, n_extr) counts of the Dingle points.
+   # Returns {key: (n_rep,) array} for BOOT_KEYS, mu_q in cm^2/(V*s).
+   temps = np.asarray(temps, dtype=float)
+   max_amps = np.asarray(max_amps, dtype=float)
+   maxs = np.asarray(maxs, dtype=float)
+   n_rep, n_temps, _ = max_amps.shape
+   n_osc = len(osc_ind)
+
+   # m_c and amp averaged over the osc_ind extremums
+   amps = max_amps[:, :, osc_ind].transpose(0, 2, 1).reshape(-1, n_temps)
+   popt, _ = RT_fit_batch(temps, amps, np.tile(np.asarray(fields)[osc_ind], n_rep))
+   popt = popt.reshape(n_rep, n_osc, 2)
+   amp, m_c = popt[..., 0].mean(axis=1), popt[..., 1].mean(axis=1)
+
+   # Dingle plot: slope of ln(A/R_T) over 1/B, weighted least squares
+   x = maxs[:, dingle_ind]
+   with np.errstate(divide='ignore', invalid='ignore'):
+      y = np.log(np.abs(max_amps[:, dingle_ind]
+         / R_T(1/x, temps[dingle_ind], amp[:, None], m_c[:, None])))
+
+   w = np.ones_like(x) if weights is None else np.asarray(weights, dtype=float)
+   w = np.where(np.isfinite(x) & np.isfinite(y), w, 0)
+   x, y = np.where(w > 0, x, 0), np.where(w > 0, y, 0)
+
+   sw, sx, sy = w.sum(axis=1), (w*x).sum(axis=1), (w*y).sum(axis=1)
+   sxx, sxy = (w*x*x).sum(axis=1), (w*x*y).sum(axis=1)
+   with np.errstate(divide='ignore', invalid='ignore'):
+      slope = (sw*sxy - sx*sy)/(sw*sxx - sx**2)
+
+      # slope = -k_B T_D/hbar omega_c
+      T_D = np.abs(slope*q*hbar/(m_c*k_B))
+      tau_q = hbar/(2*np.pi*k_B*T_D)
+      mu_q = 1e4*q*tau_q/m_c
+
+   return {'amp': amp, 'm_c': m_c, 'T_D': T_D, 'tau_q': tau_q, 'mu_q': mu_q}
+
+#########################################################################################
+### Replicates
+#########################################################################################
+def amp_replicates(rng, n_rep, temps, max_amps, maxs, fields, osc_ind, dingle_ind):
+
+   # Residual bootstrap of the amplitudes around the R_T fits (few
+   # temperatures, fixed design) and case resampling of the Dingle points
+   temps = np.asarray(temps, dtype=float)
+   max_amps = np.asarray(max_amps, dtype=float)
+   n_temps, n_extr = max_amps.shape
+
+   popt, _ = RT_fit_batch(temps, max_amps.transpose(), fields)
+   model = R_T(np.asarray(fields)[None, :], temps[:, None], popt[:, 0], popt[:, 1])
+   resid = max_amps - model
+
+   # Residuals of a 2-parameter fit to n points are smaller than the noise
+   # by sqrt((n - 2)/n) on average, rescaled before resampling
+   n_fit = np.sum(np.isfinite(resid), axis=0)
+   with np.errstate(divide='ignore', invalid='ignore'):
+      resid = resid*np.sqrt(n_fit/(n_fit - 2))
+
+   # Resample the residuals of each extremum over the temperatures
+   draw = rng.integers(0, n_temps, size=(n_rep, n_temps, n_extr))
+   rep_amps = model + np.take_along_axis(resid[None], draw, axis=1)
+
+   # Dingle points resampled as (1/B, amplitude) pairs
+   n_points = np.sum(np.isfinite(max_amps[dingle_ind]))
+   probs = np.isfinite(max_amps[dingle_ind])/max(n_points, 1)
+   weights = rng.multinomial(n_points, probs, size=n_rep)
+
+   rep_maxs = np.broadcast_to(maxs, rep_amps.shape)
+   return sdh_estimates(temps, rep_amps, rep_maxs, fields, osc_ind, dingle_ind, weights)
+
+def curve_replicates(rng, n_rep, curves, params, block_length=None):
+
+   # Moving block bootstrap of the noise of the symmetrized curves, refiltered
+   # and trimmed as in the pipeline. curves -- [(grid, sym)] per temperature.
+   # Returns replicate (maxs, max_amps) of shape (n_rep, n_temps, n_extr).
+   window = params['window_length']
+   block_length = window if block_length is None else block_length
+
+   rep_maxs, rep_amps = [], []
+   for grid, sym in curves:
+
+      n = len(sym)
+      smooth = savgol_filter(sym, window, params['polyorder'])
+      resid = sym - smooth
+
+      n_blocks = -(-n // block_length)
+      starts = rng.integers(0, n - block_length + 1, size=(n_rep, n_blocks))
+      ind = (starts[:, :, None] + np.arange(block_length)).reshape(n_rep, -1)[:, :n]
+      reps = savgol_filter(smooth + resid[ind], window, params['polyorder'],
+         params['deriv'], axis=-1)
+
+      trim = (grid > params['min_field']) & (grid < params['max_field'])
+      extrs, amps = find_extr_batch([1/grid[trim]]*n_rep, reps[:, trim], params['expected_maxs'])
+      rep_maxs.append(extrs)
+      rep_amps.append(amps)
+
+   return np.stack(rep_maxs, axis=1), np.stack(rep_amps, axis=1)
+
+def _boot_job(job):
+
+   seed, n_rep, mode, data = job
+   rng = np.random.default_rng(seed)
+
+   if mode == 'amps':
+      return amp_replicates(rng, n_rep, *data)
+
+   curves, params, temps, fields, osc_ind, dingle_ind = data
+   rep_maxs, rep_amps = curve_replicates(rng, n_rep, curves, params)
+   return sdh_estimates(temps, rep_amps, rep_maxs, fields, osc_ind, dingle_ind)
+
+#########################################################################################
+### Confidence intervals
+#########################################################################################
+def bootstrap(temps, max_amps, maxs, fields, osc_ind, dingle_ind, curves=None,
+   params=None, n_rep=2000, level=0.95, seed=0, n_workers=1, chunk_size=250):
+
+   # Percentile bootstrap of BOOT_KEYS. By default the extremum amplitudes are
+   # resampled; with curves=[(grid, sym)] per temperature and the sample
+   # params, the curve noise is resampled through filter -> trim -> extremums.
+   # Replicates run in chunks of chunk_size, each with its own seed spawned
+   # from seed, so the result does not depend on n_workers.
+   # Returns {key: (estimate, low, high)}.
+   temps = np.asarray(temps, dtype=float)
+   max_amps = np.asarray(max_amps, dtype=float)
+   maxs = np.asarray(maxs, dtype=float)
+
+   point = sdh_estimates(temps, max_amps[None], maxs[None], fields, osc_ind, dingle_ind)
+
+   if curves is None:
+      mode, data = 'amps', (temps, max_amps, maxs, fields, osc_ind, dingle_ind)
+   else:
+      mode, data = 'curves', (curves, params, temps, fields, osc_ind, dingle_ind)
+
+   sizes = [min(chunk_size, n_rep - start) for start in range(0, n_rep, chunk_size)]
+   seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+   jobs = [(child, size, mode, data) for child, size in zip(seeds, sizes)]
+   chunks = run_jobs(_boot_job, jobs, n_workers)
+
+   alpha = 100*(1 - level)/2
+   intervals = {}
+   for key in BOOT_KEYS:
+      reps = np.concatenate([chunk[key] for chunk in chunks])
+      low, high = np.nanpercentile(reps, [alpha, 100 - alpha])
+      intervals[key] = (point[key][0], low, high)
+
+   return intervals
@@ -0,0 +1,125 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+#########################################################################################
+### Rolling filters
+#########################################################################################
+# All filters work along the last axis, so a 2-D stack of curves is filtered in
+# one call. The window of sample i is volts[i-n_left:i+n_right] with
+# n_left = window // 2, clipped at the array edges (same as the old
+# SdH_func.moving_average). With chunk_size set the curves are processed in
+# blocks of that many samples, and out may be a np.memmap for arrays that do
+# not fit in memory.
+
+def _split(window):
+
+   n_left = window // 2
+   n_right = window - n_left
+   return n_left, n_right
+
+def _chunks(length, chunk_size):
+
+   if chunk_size is None or chunk_size >= length:
+      yield 0, length
+      return
+
+   for start in range(0, length, chunk_size):
+      yield start, min(start + chunk_size, length)
+
+def _prepare(volts, window, out):
+
+   volts = np.asarray(volts)
+   if window < 1:
+      raise ValueError(f"window must be positive, got {window}")
+
+   if out is None:
+      out = np.empty(volts.shape, dtype=np.result_type(volts.dtype, float))
+   elif out.shape != volts.shape:
+      raise ValueError(f"out has shape {out.shape}, expected {volts.shape}")
+
+   return volts, out
+
+def _windows(volts, start, stop, n_left, n_right):
+
+   # NaN-padded (..., stop-start, window) view of the windows of samples
+   # start..stop-1; only the padded block is copied, not the windows
+   length = volts.shape[-1]
+   first, last = start - n_left, stop - 1 + n_right
+   lo, hi = max(first, 0), min(last, length)
+
+   block = volts[..., lo:hi].astype(float)
+   pad = [(0, 0)]*(volts.ndim - 1) + [(lo - first, last - hi)]
+   block = np.pad(block, pad, constant_values=np.nan)
+
+   return sliding_window_view(block, n_left + n_right, axis=-1)
+
+def _median(windows, start, stop, n_left, n_right, length):
+
+   # Only the rows that touch an edge contain NaN padding and need nanmedian
+   med = np.median(windows, axis=-1)
+
+   inds = np.arange(start, stop)
+   edge = (inds < n_left) | (inds + n_right > length)
+   if edge.any():
+      med[..., edge] = np.nanmedian(windows[..., edge, :], axis=-1)
+
+   return med
+
+def rolling_mean(volts, window, chunk_size=None, out=None):
+
+   volts, out = _prepare(volts, window, out)
+   n_left, n_right = _split(window)
+   length = volts.shape[-1]
+
+   for start, stop in _chunks(length, chunk_size):
+
+      lo, hi = max(start - n_left, 0), min(stop - 1 + n_right, length)
+      block = volts[..., lo:hi].astype(float)
+
+      # Offset by the block mean to keep the cumulative sum accurate
+      offset = block.mean(axis=-1, keepdims=True)
+      csum = np.zeros(block.shape[:-1] + (block.shape[-1] + 1,))
+      np.cumsum(block - offset, axis=-1, out=csum[..., 1:])
+
+      inds = np.arange(start, stop)
+      left = np.maximum(inds - n_left, 0)
+      right = np.minimum(inds + n_right, length)
+
+      sums = csum[..., right - lo] - csum[..., left - lo]
+      out[..., start:stop] = sums/(right - left) + offset
+
+   return out
+
+def rolling_median(volts, window, chunk_size=None, out=None):
+
+   volts, out = _prepare(volts, window, out)
+   n_left, n_right = _split(window)
+   length = volts.shape[-1]
+
+   for start, stop in _chunks(length, chunk_size):
+      windows = _windows(volts, start, stop, n_left, n_right)
+      out[..., start:stop] = _median(windows, start, stop, n_left, n_right, length)
+
+   return out
+
+def hampel(volts, window, n_sigma=3, chunk_size=None, out=None):
+
+   # Replace spikes deviating from the rolling median by more than n_sigma
+   # scaled median absolute deviations with the median itself
+   volts, out = _prepare(volts, window, out)
+   n_left, n_right = _split(window)
+   length = volts.shape[-1]
+
+   for start, stop in _chunks(length, chunk_size):
+
+      windows = _windows(volts, start, stop, n_left, n_right)
+      med = _median(windows, start, stop, n_left, n_right, length)
+
+      deviations = np.abs(windows - med[..., None])
+      mad = 1.4826*_median(deviations, start, stop, n_left, n_right, length)
+
+      block = volts[..., start:stop]
+      spikes = np.abs(block - med) > n_sigma*mad
+      out[..., start:stop] = np.where(spikes, med, block)
+
+   return out
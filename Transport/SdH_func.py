@@ -1,5 +1,7 @@
 import numpy as np
-from scipy.optimize import curve_fit
+from scipy.optimize import curve_fit, least_squares
+
+from SdH_filters import rolling_mean
 
 # World constants
 k_B = 1.38e-23 # Boltzmann constant
@@ -10,24 +12,60 @@ m_0 = 9.11e-31
 #########################################################################################
 ### Data manipulation
 #########################################################################################
-def symmetrize(field, volts, sym=True):
+def _sorted_sweep(field, volts):
+
+   # Skip the argsort for sweeps that are already monotonic
+   step = np.diff(field)
+   if np.all(step >= 0):
+      return field, volts
+   if np.all(step <= 0):
+      return field[::-1], volts[::-1]
 
    isort = np.argsort(field)
+   return field[isort], volts[isort]
 
-   field_range = max(field) - min(field)
-   min_field = min(field) + 1e-3*field_range
-   max_field = max(field) - 1e-3*field_range
-   max_grid = min(abs(min_field), max_field)
+def symmetrize_batch(fields, volts, n_points=None):
 
-   field_grid = np.linspace(-max_grid, max_grid, 10000)
-   volts_int = np.interp(field_grid, field[isort], volts[isort])
+   # Symmetric and antisymmetric parts of many (field, volts) sweeps. Every
+   # sweep is interpolated onto its own grid symmetric around zero; with
+   # n_points=None the grid density follows the density of the data (number
+   # of points inside the grid range, the same for all sweeps). Returns an
+   # array of shape (3, n_sweeps, n_points): grids, sym and antisym parts.
+   sweeps, grid_max, counts = [], [], []
+   for field, v in zip(fields, volts):
 
-   if sym:
-      volts_sym = 0.5*(volts_int[:] + volts_int[::-1])
-   else:
-      volts_sym = 0.5*(volts_int[:] - volts_int[::-1])
+      field, v = _sorted_sweep(np.asarray(field, dtype=float), np.asarray(v, dtype=float))
+
+      field_range = field[-1] - field[0]
+      min_field = field[0] + 1e-3*field_range
+      max_field = field[-1] - 1e-3*field_range
+      max_grid = min(abs(min_field), max_field)
+
+      sweeps.append((field, v))
+      grid_max.append(max_grid)
+      counts.append(np.searchsorted(field, max_grid, 'right') - np.searchsorted(field, -max_grid, 'left'))
+
+   if n_points is None:
+      n_points = max(max(counts), 2)
+
+   grid_max = np.array(grid_max)
+   grids = np.linspace(-grid_max, grid_max, n_points, axis=-1)
+   volts_int = np.empty(grids.shape)
+   for ind, (field, v) in enumerate(sweeps):
+      volts_int[ind] = np.interp(grids[ind], field, v)
 
-   return field_grid[field_grid>0], volts_sym[field_grid>0]
+   volts_sym = 0.5*(volts_int + volts_int[:, ::-1])
+   volts_antisym = 0.5*(volts_int - volts_int[:, ::-1])
+
+   return np.array([grids, volts_sym, volts_antisym])
+
+def symmetrize(field, volts, sym=True):
+
+   grids, volts_sym, volts_antisym = symmetrize_batch([field], [volts], n_points=10000)
+   grid = grids[0]
+   volts_sym = volts_sym[0] if sym else volts_antisym[0]
+
+   return grid[grid>0], volts_sym[grid>0]
 
 def remove_bg(field, volts, sym=True):
    
@@ -39,14 +77,9 @@ def remove_bg(field, volts, sym=True):
    coeff = np.polyfit(field, volts, deg=deg)
    return volts - np.poly1d(coeff)(field)
 
-def moving_average(volts, avg_counter):
+def moving_average(volts, avg_counter, chunk_size=None):
 
-   n_left = avg_counter // 2
-   n_right = avg_counter - n_left
-
-   ret = [np.mean(volts[max(0, i-n_left):min(i+n_right, len(volts))]) for i in range(len(volts))]
-
-   return np.array(ret)
+   return rolling_mean(volts, avg_counter, chunk_size=chunk_size)
 
 def epsilon(field, volts):
    
@@ -55,30 +88,79 @@ def epsilon(field, volts):
 
 def find_extr(inv_field, volts, expected_extrs):
 
-   expected_extrs = np.array(expected_extrs)
-   extrs = np.empty(len(expected_extrs))
-   extr_amps = np.empty(len(expected_extrs))
+   extrs, extr_amps = find_extr_batch([inv_field], [volts], expected_extrs)
+   return extrs[0], extr_amps[0]
+
+def _window_sums(x, y, lo, hi, centers, half_width, max_points):
+
+   # Sums of the normal equations of z[0]*u^2 + z[1]*u + z[2] over the windows
+   # x[lo:hi], in local coordinates u centered on the window for conditioning.
+   # Windows are gathered flat (no padding) in groups of at most max_points
+   # samples and reduced with bincount.
+   counts = hi - lo
+   sums = np.zeros((8, len(counts)))
+   bounds = np.cumsum(counts)
 
+   first = 0
+   while first < len(counts):
+      last = np.searchsorted(bounds, bounds[first] - counts[first] + max_points, 'right')
+      group = np.arange(first, max(last, first + 1))
+      n = counts[group]
+
+      win = np.repeat(np.arange(len(group)), n)
+      idx = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n - lo[group], n)
+
+      u = (x[idx] - np.repeat(centers[group], n))/half_width
+      v = y[idx]
+      u2 = u*u
+      for k, weights in enumerate((None, u, u2, u2*u, u2*u2, v*u2, v*u, v)):
+         sums[k, group] = np.bincount(win, weights=weights, minlength=len(group))
+
+      first = group[-1] + 1
+
+   return sums
+
+def find_extr_batch(inv_fields, volts, expected_extrs, max_points=1 << 22):
+
+   # Quadratic fits around every expected extremum of every curve, solved as
+   # one stacked least-squares problem. Returns (n_curves, n_extr) arrays.
+   expected_extrs = np.asarray(expected_extrs, dtype=float)
    extr_dist = np.mean(expected_extrs[1:]-expected_extrs[:-1])
-   # print(extr_dist)
+   half_width = 0.3*extr_dist
+
+   n_curves = len(inv_fields)
+   sums = np.zeros((8, n_curves, len(expected_extrs)))
+   counts = np.zeros((n_curves, len(expected_extrs)), dtype=int)
 
-   for i in range(len(expected_extrs)):
+   for ind, (x, y) in enumerate(zip(inv_fields, volts)):
 
-      slice_left = expected_extrs[i] - 0.3*extr_dist
-      slice_right = expected_extrs[i] + 0.3*extr_dist
+      # Window bounds of all extremums from one searchsorted on ascending 1/B
+      x, y = _sorted_sweep(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
 
-      # print(slice_left, slice_right)
+      lo = np.searchsorted(x, expected_extrs - half_width, side='right')
+      hi = np.searchsorted(x, expected_extrs + half_width, side='left')
 
-      f_slice, v_slice = inv_field, volts
-      f_slice, v_slice = f_slice[f_slice>slice_left], v_slice[f_slice>slice_left]
-      f_slice, v_slice = f_slice[f_slice<slice_right], v_slice[f_slice<slice_right]
+      counts[ind] = hi - lo
+      sums[:, ind] = _window_sums(x, y, lo, hi, expected_extrs, half_width, max_points)
 
-      z = np.polyfit(f_slice, v_slice, 2)
-      x0 = -0.5*z[1]/z[0]
-      y0 = z[0]*x0**2+z[1]*x0+z[2]
+   p0, p1, p2, p3, p4 = sums[:5]
+   rhs = np.stack(sums[5:], axis=-1)
+   lhs = np.stack([
+      np.stack([p4, p3, p2], axis=-1),
+      np.stack([p3, p2, p1], axis=-1),
+      np.stack([p2, p1, p0], axis=-1),
+   ], axis=-2)
 
-      extrs[i] = x0
-      extr_amps[i] = y0
+   # Windows with fewer than 3 distinct points have a singular lhs; they give
+   # NaN instead of stopping the whole batch (polyfit only warned there)
+   z = np.full(counts.shape + (3,), np.nan)
+   ok = counts >= 3
+   ok[ok] = np.linalg.cond(lhs[ok]) < 1e10
+   z[ok] = np.linalg.solve(lhs[ok], rhs[ok][..., None])[..., 0]
+
+   u0 = -0.5*z[..., 1]/z[..., 0]
+   extr_amps = z[..., 0]*u0**2 + z[..., 1]*u0 + z[..., 2]
+   extrs = expected_extrs[None, :] + half_width*u0
 
    return extrs, extr_amps
 
@@ -118,6 +200,73 @@ def find_extr(inv_field, volts, expected_extrs):
 
 #    return mins[::-1], maxs[::-1], min_amps[::-1], max_amps[::-1]
 
+#########################################################################################
+### Spectrum
+#########################################################################################
+def uniform_inv_field(fields, curves, n_points=None):
+
+   # Resample curves onto one uniform 1/B grid covering the range common to
+   # all of them. Returns (inv_grid, (n_curves, n_points) array).
+   inv_fields = [1/np.asarray(field, dtype=float) for field in fields]
+   x_min = max(inv.min() for inv in inv_fields)
+   x_max = min(inv.max() for inv in inv_fields)
+   if n_points is None:
+      n_points = max(len(inv) for inv in inv_fields)
+
+   inv_grid = np.linspace(x_min, x_max, n_points)
+   resampled = np.empty((len(inv_fields), n_points))
+   for ind, (inv, curve) in enumerate(zip(inv_fields, curves)):
+      isort = np.argsort(inv)
+      resampled[ind] = np.interp(inv_grid, inv[isort], np.asarray(curve)[isort])
+
+   return inv_grid, resampled
+
+def osc_spectrum(fields, curves, pad_factor=8, n_points=None):
+
+   # Amplitude spectrum over the SdH frequency (in T) of every curve. The
+   # curves are resampled on a uniform 1/B grid, detrended by their mean,
+   # Hann-windowed and zero-padded to pad_factor times their length, then
+   # transformed with a single 2-D real FFT. Normalized so that a pure
+   # a*cos(2 pi F/B) gives a peak of height close to a.
+   inv_grid, resampled = uniform_inv_field(fields, curves, n_points)
+   n = resampled.shape[-1]
+
+   window = np.hanning(n)
+   resampled = (resampled - resampled.mean(axis=-1, keepdims=True))*window
+
+   n_fft = int(2**np.ceil(np.log2(pad_factor*n)))
+   spectra = 2*np.abs(np.fft.rfft(resampled, n=n_fft, axis=-1))/window.sum()
+   freqs = np.fft.rfftfreq(n_fft, d=inv_grid[1]-inv_grid[0])
+
+   return freqs, spectra
+
+def find_freq_peaks(freqs, spectra, n_peaks=3, min_freq=0):
+
+   # n_peaks highest local maxima of every spectrum, refined by parabolic
+   # interpolation. Returns (n_curves, n_peaks) arrays of frequencies and
+   # amplitudes, sorted by amplitude, NaN where fewer peaks were found.
+   spectra = np.atleast_2d(spectra)
+   inner = spectra[:, 1:-1]
+   is_peak = (inner > spectra[:, :-2]) & (inner >= spectra[:, 2:])
+   is_peak &= (freqs[1:-1] >= min_freq)
+
+   heights = np.where(is_peak, inner, -np.inf)
+   order = np.argsort(-heights, axis=-1)[:, :n_peaks]
+   top = np.take_along_axis(heights, order, axis=-1)
+
+   # Vertex of the parabola through the peak bin and its neighbours
+   rows = np.arange(len(spectra))[:, None]
+   left, mid, right = spectra[rows, order], spectra[rows, order+1], spectra[rows, order+2]
+   denom = left - 2*mid + right
+   shift = np.where(denom != 0, 0.5*(left - right)/np.where(denom != 0, denom, 1), 0)
+
+   df = freqs[1] - freqs[0]
+   peak_freqs = freqs[order+1] + shift*df
+   peak_amps = mid - 0.25*(left - right)*shift
+
+   found = np.isfinite(top)
+   return np.where(found, peak_freqs, np.nan), np.where(found, peak_amps, np.nan)
+
 #########################################################################################
 ### Lifshitz-Cosevich
 #########################################################################################
@@ -140,9 +289,40 @@ def LC_amp(B, T, amp, m_c, T_D):
 
 	return R_T(B, T, amp, m_c) * R_D(B, T_D, m_c)
 
-def LC_func(B, T, m_c, T_D, f, ph):
+def LC_func(B, T, amp, m_c, T_D, f, ph):
+
+	return LC_amp(B, T, amp, m_c, T_D) * osc(B, f, ph)
+
+def x_over_sinh(x):
+
+	# x/sinh(x) and its derivative, finite at x=0 and for large x
+	ax = np.abs(x)
+	small = ax < 1e-4
+	e = np.exp(-ax)
+	ax_safe = np.where(small, 1, ax)
+	val = np.where(small, 1 - ax**2/6, 2*ax_safe*e/(1 - e**2 + small))
+	coth = np.where(small, 0, (1 + e**2)/(1 - e**2 + small))
+	der = np.where(small, -ax/3, val*(1/ax_safe - coth))
+	return val, np.sign(x)*der
 
-	return LC_amp(B, T, m_c, T_D) * osc(B, f, ph)
+def LC_jac(B, T, amp, m_c, T_D, f, ph):
+
+	# Derivatives of LC_func over (amp, m_c, T_D, f, ph), shape (len(B), 5)
+	X = 2*np.pi**2*k_B*T*m_c/(hbar*q*B)
+	rt, drt = x_over_sinh(X)
+	rd = R_D(B, T_D, m_c)
+	phase = 2*np.pi*f/B + ph
+	cos, sin = np.cos(phase), np.sin(phase)
+
+	model = amp*rt*rd*cos
+	d_amp = rt*rd*cos
+	d_rt = amp*drt*X/m_c*rd*cos
+	d_rd = -model*k_B*T_D/(hbar*q*B)
+	d_TD = -model*k_B*m_c/(hbar*q*B)
+	d_f = -amp*rt*rd*sin*2*np.pi/B
+	d_ph = -amp*rt*rd*sin
+
+	return np.stack([d_amp, d_rt + d_rd, d_TD, d_f, d_ph], axis=-1)
 
 #########################################################################################
 ### Curve fitting
@@ -154,3 +334,139 @@ def RT_fit(temps, amps, B, p0=None):
 		return R_T(B, T, a, m_c)
 
 	return curve_fit(fit_func, temps, amps, p0=p0)
+
+def lm_batch(model, p0, y, valid=None, max_iter=100, rtol=1e-10):
+
+	# Levenberg-Marquardt for many independent least squares problems of the
+	# same form, all stepping together, each with its own damping. model(p)
+	# with p -- (n_sets, n_par) returns (values, jacobian) of shapes
+	# (n_sets, n_points) and (n_sets, n_points, n_par). Points that are NaN
+	# in y or False in valid are ignored. Returns (popt, pcov), pcov as in
+	# curve_fit; sets with fewer points than parameters are NaN.
+	y = np.asarray(y, dtype=float)
+	valid = np.isfinite(y) if valid is None else valid & np.isfinite(y)
+	y = np.where(valid, y, 0)
+	p = np.array(p0, dtype=float)
+	n_par = p.shape[1]
+
+	def evaluate(p):
+		val, jac = model(p)
+		return np.where(valid, val - y, 0), np.where(valid[..., None], jac, 0)
+
+	res, J = evaluate(p)
+	cost = np.sum(res**2, axis=-1)
+	lam = np.full(len(p), 1e-3)
+	fitted = np.sum(valid, axis=-1) >= n_par
+	active = fitted.copy()
+	for _ in range(max_iter):
+
+		JTJ = np.einsum('nti,ntj->nij', J, J)
+		JTr = np.einsum('nti,nt->ni', J, res)
+		A = JTJ + lam[:, None, None]*JTJ*np.eye(n_par)
+		step = -np.einsum('nij,nj->ni', np.linalg.pinv(A), JTr)
+		step[~active] = 0
+
+		new_res, new_J = evaluate(p + step)
+		new_cost = np.sum(new_res**2, axis=-1)
+		better = new_cost < cost
+
+		done = (~better & (lam > 1e10)) | (better & (cost - new_cost <= rtol*cost))
+		p = np.where(better[:, None], p + step, p)
+		res = np.where(better[:, None], new_res, res)
+		J = np.where(better[:, None, None], new_J, J)
+		cost = np.where(better, new_cost, cost)
+		lam = np.where(better, lam/10, lam*10)
+
+		active &= ~done
+		if not active.any():
+			break
+
+	dof = np.maximum(np.sum(valid, axis=-1) - n_par, 1)
+	pcov = np.linalg.pinv(np.einsum('nti,ntj->nij', J, J))*(cost/dof)[:, None, None]
+	p[~fitted], pcov[~fitted] = np.nan, np.nan
+
+	return p, pcov
+
+def RT_fit_batch(temps, amps, B, p0=None, max_iter=100, rtol=1e-10):
+
+	# Fits R_T(B, T, amp, m_c) to many amplitude(T) sets at once, e.g. all
+	# extremums of all samples. amps -- (n_sets, n_temps) with NaN for missing
+	# points, temps -- (n_temps,) or (n_sets, n_temps), B -- (n_sets,) fields
+	# of the extremums. Returns (popt, pcov) of shapes (n_sets, 2) and
+	# (n_sets, 2, 2) with popt[:, 1] the effective mass at each field.
+	amps = np.atleast_2d(np.asarray(amps, dtype=float))
+	T = np.broadcast_to(np.asarray(temps, dtype=float), amps.shape)
+	B = np.broadcast_to(np.asarray(B, dtype=float), amps.shape[:1])
+	valid = np.isfinite(amps) & np.isfinite(T)
+	y = np.where(valid, amps, 0)
+
+	# R_T = amp*x/sinh(x) with x = b*T is linear in amp; b = 2 pi^2 k_B m_c/(hbar q B)
+	to_m_c = hbar*q*B/(2*np.pi**2*k_B)
+
+	def model(p):
+		val, der = x_over_sinh(p[:, 1, None]*T)
+		return p[:, 0, None]*val, np.stack([val, p[:, 0, None]*der*T], axis=-1)
+
+	if p0 is None:
+		# Best b on a log grid, with the amplitude solved for exactly
+		b_grid = np.logspace(-3, 1, 41)
+		val = np.where(valid[:, None], x_over_sinh(b_grid[None, :, None]*T[:, None])[0], 0)
+		amp_grid = np.sum(val*y[:, None], axis=-1)/np.maximum(np.sum(val**2, axis=-1), 1e-300)
+		cost = np.sum((amp_grid[..., None]*val - y[:, None])**2, axis=-1)
+		best = np.argmin(cost, axis=1)
+		p0 = np.stack([amp_grid[np.arange(len(B)), best], b_grid[best]], axis=-1)
+	else:
+		p0 = np.broadcast_to(np.asarray(p0, dtype=float), (len(B), 2))
+		p0 = np.stack([p0[:, 0], p0[:, 1]/to_m_c], axis=-1)
+
+	popt, cov = lm_batch(model, p0, amps, valid, max_iter, rtol)
+	amp, b = popt.transpose()
+
+	# Covariance transformed from (amp, b) to (amp, m_c)
+	scale = np.stack([np.ones(len(B)), np.sign(b)*to_m_c], axis=-1)
+	popt = np.stack([amp, np.abs(b)*to_m_c], axis=-1)
+	pcov = cov*scale[:, :, None]*scale[:, None, :]
+
+	return popt, pcov
+
+def LC_global_fit(fields, curves, temps, p0, offsets=True):
+
+	# Joint fit of LC_func to the curves of all temperatures of a sample with
+	# shared (amp, m_c, T_D, f, ph) and, if offsets, a constant offset per
+	# curve. Returns (popt, pcov) like curve_fit, offsets appended to popt.
+	B = np.concatenate([np.asarray(field, dtype=float) for field in fields])
+	y = np.concatenate([np.asarray(curve, dtype=float) for curve in curves])
+	T = np.concatenate([np.full(len(field), float(temp)) for field, temp in zip(fields, temps)])
+	curve_ind = np.repeat(np.arange(len(fields)), [len(field) for field in fields])
+
+	# m_c is fitted in units of m_0 to keep the parameters of similar scale
+	n_off = len(fields) if offsets else 0
+	scale = np.ones(5 + n_off)
+	scale[1] = m_0
+	x0 = np.concatenate([np.asarray(p0, dtype=float), np.zeros(n_off)])/scale
+
+	def residuals(x):
+		p = x*scale
+		res = LC_func(B, T, *p[:5]) - y
+		if offsets:
+			res += p[5:][curve_ind]
+		return res
+
+	def jac(x):
+		p = x*scale
+		J = LC_jac(B, T, *p[:5])*scale[:5]
+		if offsets:
+			J = np.hstack([J, np.eye(n_off)[curve_ind]])
+		return J
+
+	result = least_squares(residuals, x0, jac=jac, method='lm', x_scale='jac')
+
+	# Covariance as in curve_fit: (J^T J)^-1 scaled by the residual variance
+	dof = max(len(y) - len(x0), 1)
+	J = result.jac
+	cov = np.linalg.pinv(J.T @ J)*np.sum(result.fun**2)/dof
+
+	popt = result.x*scale
+	pcov = cov*np.outer(scale, scale)
+
+	return popt, pcov
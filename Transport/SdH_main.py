@@ -3,10 +3,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 
-from scipy.optimize import curve_fit
-
 # local imports
-from SdH_samples import samples
+from SdH_samples import results, samples
 from SdH_func import (
    hbar,
    k_B,
@@ -18,10 +16,13 @@ from SdH_func import (
    symmetrize,
    LC_amp,
    LC_func,
+   LC_global_fit,
+   RT_fit_batch,
    R_T,
    R_D,
 )
-from SdH_plots import SdH_figure
+from SdH_plots import SdH_figure, plot_curve
+from SdH_bootstrap import bootstrap
 # rc('text', usetex=True)
 # rc('text.latex',preamble=r'\usepackage[utf8]{inputenc}')
 # rc('text.latex',preamble=r'\usepackage[russian]{babel}')
@@ -29,9 +30,21 @@ from SdH_plots import SdH_figure
 ### Figures setup
 #########################################################################################
 
+# Bootstrap replicates for the confidence intervals; boot_curves resamples the
+# noise of the curves instead of the extremum amplitudes (slower)
+n_boot = 2000
+boot_level = 0.95
+boot_curves = False
+
 
 for num in samples.keys():
 
+   # Process all temperatures of the sample at once. fit_params is the stored
+   # row of the sample: fits found there were done with the same data and
+   # parameters and are not repeated.
+   samples.run([num])
+   fit_params = samples[num]['fit_params']
+
    fig, ax = SdH_figure()
    ax_osc, ax_ext, ax_temp, ax_dng = ax
 
@@ -47,6 +60,32 @@ for num in samples.keys():
    x_max = 1/(samples[num]['min_field']-0.2)
    ax_osc.set_xlim(x_min, x_max)
 
+   # Oscillation frequencies from the FFT of the filtered curves
+   spec_temps, _, _, peak_freqs, peak_amps = samples[num].spectrum()
+   for temp, freqs in zip(spec_temps, peak_freqs):
+      print(f"{num}: T = {temp} K, F = " + ", ".join(f"{f:.1f}" for f in freqs[np.isfinite(freqs)]) + " T")
+
+   # Joint Lifshitz-Kosevich fit of all temperatures. Initial guess: frequency
+   # from the expected extremum spacing, phase and amplitude from the maxima
+   # of the lowest temperature.
+   temps = list(samples[num]['data'].keys())
+   t_low = min(temps, key=float)
+   f0 = 1/np.mean(np.diff(samples[num]['expected_maxs']))
+   ph0 = -2*np.pi*f0*samples[num]['maxs'][t_low][0]
+   amp0 = max(abs(samples[num]['max_amps'][t_low]))
+
+   if 'LC_global' not in fit_params:
+      lc_popt, lc_pcov = LC_global_fit(
+         [samples[num]['data'][temp][0] for temp in temps],
+         [samples[num]['data'][temp][1] for temp in temps],
+         [float(temp) for temp in temps],
+         p0=(amp0, 0.3*m_0, 10, f0, ph0))
+      fit_params['LC_global'] = lc_popt[:5]
+      fit_params['LC_offsets'] = lc_popt[5:]
+   lc_popt = np.concatenate([fit_params['LC_global'], fit_params['LC_offsets']])
+
+   print(f"{num}: LK fit m_c = {(lc_popt[1]/m_0):.2f} m_0, T_D = {lc_popt[2]:.1f} K, F = {lc_popt[3]:.1f} T")
+
    for ind, temp in enumerate(samples[num]['data'].keys()):
 
       # if float(temp)!=3:
@@ -58,7 +97,7 @@ for num in samples.keys():
       shift = samples[num]["osc_shifts"][ind]
 
       color = cm.winter(float(temp)/30.0)
-      ax_osc.plot(1/field, volts+shift, label=r'$T={temp}$K', color=color, lw=2)
+      plot_curve(ax_osc, 1/field, volts+shift, label=r'$T={temp}$K', color=color, lw=2)
       ax_osc.annotate(f'{temp}K', xy=(1/samples[num]['min_field']+1e-3, shift), fontsize=15)
 
       mins = samples[num]['mins'][temp]
@@ -69,11 +108,8 @@ for num in samples.keys():
       # ax_osc.scatter(mins, min_amps+shift, c='k')
       # ax_osc.scatter(maxs, max_amps+shift, c='r')
 
-      # pvis = (1.5e-1, 2.7, 190, 590, samples[num]['m_c'])
-      # popt = LC_fit(field, volts, T=3, p0=pvis)
-      # print(popt)
-      # ax_osc.plot(1/field, LC_func(field, 3, *popt)+shift, color=color, lw=1.5, ls='--')
-      # ax_osc.plot(1/field, LC_func(field, float(temp), *pvis)+shift, color='k')
+      lc_curve = LC_func(field, float(temp), *lc_popt[:5]) + lc_popt[5+ind]
+      plot_curve(ax_osc, 1/field, lc_curve+shift, color='k', lw=1, ls='--')
 
    ####################################################################################
    ### Extremums
@@ -108,7 +144,7 @@ for num in samples.keys():
 
       n_SdH = 2*np.pi*degeneracy*q/(hbar)/a
       print(f"{num}: n_SdH = {n_SdH:.3e}")
-      samples[num]['n_SdH'] = n_SdH
+      fit_params['n_SdH'] = n_SdH
 
    ####################################################################################
    ### Temperature dependencies
@@ -142,29 +178,39 @@ for num in samples.keys():
    t_sort = np.argsort(temps)
    ax_temp.set_xlim(0, max(temps)*1.15)
 
+   # R_T fit at the field of every extremum, all in one batch: m_c(B)
+   if 'm_c_B' not in fit_params:
+      extr_temps = list(samples[num]['max_amps'].keys())
+      fields = 1/samples[num]['mins'][extr_temps[0]]
+      popt, pcov = RT_fit_batch([float(temp) for temp in extr_temps],
+         np.transpose(list(samples[num]['max_amps'].values())), fields)
+      fit_params['RT_popt'] = popt
+      fit_params['m_c_B'] = np.array([fields, popt[:, 1]])
+
+   fields, masses = fit_params['m_c_B']
+   valid = np.isfinite(masses)
+   print(f"{num}: m_c(B) = " + ", ".join(f"{m/m_0:.2f}" for m in masses[valid])
+      + f" m_0 at B = {fields[valid].min():.1f}..{fields[valid].max():.1f} T")
+
    for j, ind in enumerate(samples[num]['osc_ind']):
       
       amps = max_amps[t_sort, j]
 
-      def fit_func(T, a, b):
-         # here b = 2 pi^2 k_B m_c / hbar q B
-         return a*T/np.sinh(b*T)
-
       ax_temp.scatter(temps[t_sort], amps, color=cm.hot(j/len(samples[num]['osc_ind'])))
-      popt, pcov = curve_fit(fit_func, temps[t_sort], amps, p0=(1e-3, 1))
+      amp, m_c = fit_params['RT_popt'][ind]
 
       B = 1 / mins[0, j]
 
-      samples[num]['fit_params']['amp'] = popt[0]/popt[1]
-      m_c = abs(popt[1]*hbar*q*B/(np.pi**2 * k_B))
-      samples[num]['fit_params']['m_c'] = m_c
-
       print(f"{num}: m_c = {m_c:.3e} = {(m_c/9.1e-31):.2f} m_0")
       t_grid = np.linspace(0, max(temps)*1.2, 100)
-      opt_grid = fit_func(t_grid, *popt)
+      opt_grid = R_T(B, t_grid, amp, m_c)
       
       ax_temp.plot(t_grid, opt_grid)
 
+   # Dingle plots use the mass averaged over the osc_ind extremums
+   fit_params['amp'] = np.mean(fit_params['RT_popt'][samples[num]['osc_ind'], 0])
+   fit_params['m_c'] = np.mean(fit_params['RT_popt'][samples[num]['osc_ind'], 1])
+
    ####################################################################################
    ### Dingle plots
    ####################################################################################
@@ -186,8 +232,8 @@ for num in samples.keys():
       color = cm.winter(float(temp)/30.0)
       B = 1/maxs
       T = float(temp)
-      amp = samples[num]['fit_params']['amp']
-      m_c = samples[num]['fit_params']['m_c']
+      amp = fit_params['amp']
+      m_c = fit_params['m_c']
    
       ax_dng.scatter(maxs, np.log(max_amps/R_T(B, T, amp, m_c)), color=color)
       a, b = np.polyfit(maxs, np.log(max_amps/R_T(B, T, amp, m_c)), deg=1)
@@ -200,9 +246,40 @@ for num in samples.keys():
       tau_q = hbar/(2*np.pi*k_B*T_D)
       mu_SdH = q*tau_q/m_c
       print(f"{num}: tau_q = {tau_q:.3e} [s], mu_SdH = {1e4*mu_SdH:.1f} [cm^2/V*s]")
-      samples[num]['fit_params']['T_D'] = T_D
-      samples[num]['fit_params']['tau_q'] = tau_q
-      samples[num]['fit_params']['mu_q'] = 1e4*q*tau_q/m_c
+      fit_params['T_D'] = T_D
+      fit_params['tau_q'] = tau_q
+      fit_params['mu_q'] = 1e4*q*tau_q/m_c
+
+   ####################################################################################
+   ### Confidence intervals
+   ####################################################################################
+   # Bootstrap of the extremum amplitudes (boot_curves: of the curve noise
+   # through filter -> extremums) for the Dingle temperature of the plots above
+   # (intervals stored before the residuals were rescaled are recomputed)
+   boot_settings = f"n_boot={n_boot}, level={boot_level}, curves={boot_curves}, resid=scaled"
+   if fit_params.get('boot_settings') != boot_settings:
+
+      extr_temps = list(samples[num]['max_amps'].keys())
+      dingle_ind = [ind for ind, temp in enumerate(extr_temps) if float(temp) <= 5][-1]
+      curves = None
+      if boot_curves:
+         curves = [samples[num].get_stage('symmetrize', temp) for temp in extr_temps]
+
+      intervals = bootstrap([float(temp) for temp in extr_temps],
+         list(samples[num]['max_amps'].values()), list(samples[num]['maxs'].values()),
+         1/samples[num]['mins'][extr_temps[0]], samples[num]['osc_ind'], dingle_ind,
+         curves=curves, params=samples[num].params, n_rep=n_boot, level=boot_level,
+         n_workers=samples.n_workers)
+
+      for key, (val, low, high) in intervals.items():
+         fit_params[key + '_ci'] = np.array([low, high])
+      fit_params['boot_settings'] = boot_settings
+
+   for key in ('m_c', 'T_D', 'tau_q', 'mu_q'):
+      low, high = fit_params[key + '_ci']
+      print(f"{num}: {key} = {fit_params[key]:.3e}, {100*boot_level:.0f}% CI [{low:.3e}, {high:.3e}]")
+
+results.save()
 
 plt.savefig("SdH_figure.png")
 plt.show()
\ No newline at end of file
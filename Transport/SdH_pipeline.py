@@ -0,0 +1,355 @@
+import os
+from collections.abc import Mapping, MutableMapping
+
+import numpy as np
+from scipy.signal import savgol_filter
+
+from dat_cache import load_dat
+from parallel import run_jobs
+from SdH_func import (
+   epsilon,
+   symmetrize,
+   symmetrize_batch,
+   find_extr_batch,
+   find_freq_peaks,
+   osc_spectrum
+)
+
+# Keys of a samples[num] entry the per-temperature processing depends on
+PROCESS_KEYS = ('b_ind', 'x_ind', 'window_length', 'polyorder', 'deriv',
+   'min_field', 'max_field')
+
+# Grid size of the symmetrized curves, window_length of the samples is
+# calibrated on it (same as SdH_func.symmetrize)
+SYM_POINTS = 10000
+
+# Further keys the extremums and the fits of a sample depend on; with a result
+# store, cached results are reused while these and the data files are unchanged
+EXTR_KEYS = PROCESS_KEYS + ('expected_mins', 'expected_maxs')
+FIT_KEYS = EXTR_KEYS + ('n0', 'osc_ind')
+
+# Keys computed by the pipeline, as (stage, index in the stage result)
+STAGE_KEYS = {
+   'data': ('trim', None),
+   'mins': ('mins', 0),
+   'min_amps': ('mins', 1),
+   'maxs': ('maxs', 0),
+   'max_amps': ('maxs', 1),
+}
+
+#########################################################################################
+### Processing stages
+#########################################################################################
+def load_stage(fname, params):
+
+   # Extract raw data and scale it to epsilon
+   raw_data = load_dat(fname, delimiter='\t').transpose()
+   field = raw_data[params["b_ind"]]
+   return field, epsilon(field, raw_data[params["x_ind"]])
+
+def symmetrize_stage(loaded, params):
+
+   return symmetrize(*loaded)
+
+def filter_stage(symmetrized, params):
+
+   # Apply Savitzky-Golay filter
+   grid, sym = symmetrized
+   sym_filt = savgol_filter(sym, params['window_length'], params['polyorder'], params['deriv'])
+   return grid, sym_filt
+
+def trim_stage(filtered, params):
+
+   grid, sym_filt = filtered
+   max_field = params['max_field']
+   min_field = params['min_field']
+   grid, sym_filt = grid[grid<max_field], sym_filt[grid<max_field]
+   grid, sym_filt = grid[grid>min_field], sym_filt[grid>min_field]
+
+   return np.array([grid, sym_filt])
+
+# stage name -> (previous stage, function)
+STAGES = {
+   'load': (None, load_stage),
+   'symmetrize': ('load', symmetrize_stage),
+   'filter': ('symmetrize', filter_stage),
+   'trim': ('filter', trim_stage),
+}
+
+def process_temp(fname, params):
+
+   result = fname
+   for prev, func in STAGES.values():
+      result = func(result, params)
+   return result
+
+def _process_job(job):
+
+   num, temp, fname, params = job
+   return num, temp, process_temp(fname, params)
+
+def temp_files(data_dir):
+
+   # (temp, fname) pairs in a fixed order; the order of samples[num]['data']
+   # keys is used to pick osc_shifts in SdH_main
+   return [(fname.removesuffix('.dat').removeprefix("T="), os.path.join(data_dir, fname))
+      for fname in sorted(os.listdir(data_dir))]
+
+#########################################################################################
+### Lazy samples
+#########################################################################################
+class StageView(Mapping):
+
+   # Read-only {temp: result} view of one pipeline key of a sample, computed
+   # on first access of each temperature
+
+   def __init__(self, sample, key):
+
+      self.sample = sample
+      self.key = key
+
+   def __getitem__(self, temp):
+
+      if temp not in self.sample.files:
+         raise KeyError(temp)
+      return self.sample.get_result(self.key, [temp])[0]
+
+   def __iter__(self):
+
+      return iter(self.sample.files)
+
+   def __len__(self):
+
+      return len(self.sample.files)
+
+   def values(self):
+
+      # Compute all temperatures at once, extremums in one batch
+      return self.sample.get_result(self.key, list(self.sample.files))
+
+   def items(self):
+
+      return list(zip(self.sample.files, self.values()))
+
+class LazySample(MutableMapping):
+
+   # One entry of samples: the configuration keys of the sample plus the
+   # pipeline keys 'data', 'mins', 'min_amps', 'maxs', 'max_amps', each
+   # computed lazily per temperature and memoized. With a ResultStore the
+   # extremums are also stored on disk per temperature and 'fit_params' is
+   # the stored row of the sample.
+
+   def __init__(self, num, params, data_root, results=None):
+
+      self.num = num
+      self.params = {key: val for key, val in params.items() if key not in STAGE_KEYS}
+      self.data_dir = os.path.join(data_root, num)
+      self.results = results
+      self.cache = {}
+      self._files = None
+
+   @property
+   def files(self):
+
+      if self._files is None:
+         self._files = dict(temp_files(self.data_dir))
+      return self._files
+
+   def process_params(self):
+
+      return {key: self.params[key] for key in PROCESS_KEYS}
+
+   def result_row(self, temp=None):
+
+      # Stored results of one temperature, or of the sample fits for temp=None
+      if temp is None:
+         fnames = sorted(self.files.values())
+         keys = FIT_KEYS
+      else:
+         fnames = [self.files[temp]]
+         keys = EXTR_KEYS
+
+      key = self.results.key(fnames, {key: self.params[key] for key in keys})
+      return self.results.row(key, self.num, temp)
+
+   def load_results(self, temps):
+
+      # Fill the cache with the extremums found in the result store
+      if self.results is None:
+         return
+
+      for temp in temps:
+         row = self.result_row(temp)
+         for kind in ('mins', 'maxs'):
+            if kind in row:
+               self.cache[(kind, temp)] = (row[kind], row[kind[:-1] + '_amps'])
+
+   def get_stage(self, stage, temp):
+
+      if (stage, temp) not in self.cache:
+
+         prev, func = STAGES[stage]
+         if prev is None:
+            arg = self.files[temp]
+         else:
+            arg = self.get_stage(prev, temp)
+
+         self.cache[(stage, temp)] = func(arg, self.params)
+
+      return self.cache[(stage, temp)]
+
+   def symmetrize_all(self, temps):
+
+      # Symmetrize all missing temperatures with one symmetrize_batch call
+      temps = [temp for temp in temps
+         if ('symmetrize', temp) not in self.cache and ('trim', temp) not in self.cache]
+      if not temps:
+         return
+
+      loaded = [self.get_stage('load', temp) for temp in temps]
+      grids, volts_sym, _ = symmetrize_batch([field for field, _ in loaded],
+         [eps for _, eps in loaded], n_points=SYM_POINTS)
+
+      for ind, temp in enumerate(temps):
+         positive = grids[ind] > 0
+         self.cache[('symmetrize', temp)] = (grids[ind][positive], volts_sym[ind][positive])
+
+   def compute_extr(self, kind, temps):
+
+      # kind is 'mins' or 'maxs'; all missing temperatures in one batch
+      self.load_results(temps)
+      temps = [temp for temp in temps if (kind, temp) not in self.cache]
+      if not temps:
+         return
+
+      curves = [self.get_stage('trim', temp) for temp in temps]
+      extrs, amps = find_extr_batch([1/curve[0] for curve in curves],
+         [curve[1] for curve in curves], self.params['expected_' + kind])
+
+      for ind, temp in enumerate(temps):
+         self.cache[(kind, temp)] = (extrs[ind], amps[ind])
+         if self.results is not None:
+            row = self.result_row(temp)
+            row[kind], row[kind[:-1] + '_amps'] = extrs[ind], amps[ind]
+
+   def spectrum(self, n_peaks=3, min_freq=20, pad_factor=8):
+
+      # Oscillation spectra of all temperatures of the sample, computed in one
+      # 2-D FFT: (temps, freqs, spectra, peak_freqs, peak_amps)
+      key = ('spectrum', n_peaks, min_freq, pad_factor)
+      if key not in self.cache:
+
+         temps = list(self.files)
+         curves = self.get_result('data', temps)
+         freqs, spectra = osc_spectrum([curve[0] for curve in curves],
+            [curve[1] for curve in curves], pad_factor=pad_factor)
+         peak_freqs, peak_amps = find_freq_peaks(freqs, spectra, n_peaks, min_freq)
+
+         self.cache[key] = (temps, freqs, spectra, peak_freqs, peak_amps)
+
+      return self.cache[key]
+
+   def get_result(self, key, temps):
+
+      stage, ind = STAGE_KEYS[key]
+      if stage in ('mins', 'maxs'):
+         self.compute_extr(stage, temps)
+
+      results = [self.get_stage(stage, temp) for temp in temps]
+      if ind is not None:
+         results = [result[ind] for result in results]
+
+      return results
+
+   def __getitem__(self, key):
+
+      if key in STAGE_KEYS:
+         return StageView(self, key)
+      if key == 'fit_params' and self.results is not None:
+         return self.result_row()
+      return self.params[key]
+
+   def __setitem__(self, key, value):
+
+      if key in STAGE_KEYS:
+         raise KeyError(f"'{key}' is computed by the pipeline")
+      if key in EXTR_KEYS:
+         self.cache.clear()
+      self.params[key] = value
+
+   def __delitem__(self, key):
+
+      del self.params[key]
+
+   def __iter__(self):
+
+      yield from self.params
+      yield from STAGE_KEYS
+
+   def __len__(self):
+
+      return len(self.params) + len(STAGE_KEYS)
+
+class SdHPipeline(Mapping):
+
+   # {num: LazySample}. Creating it touches no files; samples[num] processes
+   # only the requested sample and temperatures. run() computes everything
+   # up front, in a process pool unless n_workers is 1 (None -- one worker
+   # per core). Temperatures with extremums in the ResultStore results are
+   # not processed by run().
+
+   def __init__(self, samples, data_root="RB_curves", n_workers=1, results=None):
+
+      self.data_root = data_root
+      self.n_workers = n_workers
+      self.results = results
+      self.samples = {num: LazySample(num, params, data_root, results)
+         for num, params in samples.items()}
+
+   def __getitem__(self, num):
+
+      return self.samples[num]
+
+   def __iter__(self):
+
+      return iter(self.samples)
+
+   def __len__(self):
+
+      return len(self.samples)
+
+   def run(self, nums=None):
+
+      if nums is None:
+         nums = list(self.samples)
+
+      # Temperatures without extremums in the cache or the result store
+      missing = {}
+      for num in nums:
+         sample = self.samples[num]
+         sample.load_results(list(sample.files))
+         missing[num] = [temp for temp in sample.files
+            if ('mins', temp) not in sample.cache or ('maxs', temp) not in sample.cache]
+
+      if self.n_workers == 1:
+         # Serially, all temperatures of a sample are symmetrized in one call
+         for num in nums:
+            self.samples[num].symmetrize_all(missing[num])
+
+      else:
+         jobs = []
+         for num in nums:
+            sample = self.samples[num]
+            for temp in missing[num]:
+               if ('trim', temp) not in sample.cache:
+                  jobs.append((num, temp, sample.files[temp], sample.process_params()))
+
+         for num, temp, data in run_jobs(_process_job, jobs, self.n_workers):
+            self.samples[num].cache[('trim', temp)] = data
+
+      for num in nums:
+         sample = self.samples[num]
+         sample.compute_extr('mins', list(sample.files))
+         sample.compute_extr('maxs', list(sample.files))
+
+      return self
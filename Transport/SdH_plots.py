@@ -1,3 +1,4 @@
+import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib import rc
@@ -117,3 +118,37 @@ def SdH_figure():
 	
 	return fig, ax
 
+####################################################################################
+### Dense curves
+####################################################################################
+def decimate_minmax(x, y, n_buckets):
+
+	# Splits the curve into n_buckets runs of consecutive points and keeps the
+	# lowest and the highest point of each run (plus the end points), in their
+	# original order. Drawn as a line at n_buckets pixels width, the result
+	# looks the same as the full curve.
+	x, y = np.asarray(x), np.asarray(y)
+	n = len(y)
+	if n <= 2*n_buckets:
+		return x, y
+
+	size = -(-n // n_buckets)
+	n_buckets = -(-n // size)
+	runs = np.pad(y, (0, n_buckets*size - n), mode='edge').reshape(n_buckets, size)
+
+	offsets = size*np.arange(n_buckets)
+	keep = np.concatenate([[0, n-1], offsets + runs.argmin(axis=1), offsets + runs.argmax(axis=1)])
+	keep = np.unique(np.minimum(keep, n-1))
+
+	return x[keep], y[keep]
+
+def plot_curve(ax, x, y, *args, decimate=True, n_buckets=None, **kwargs):
+
+	# ax.plot for curves with many more points than the axes is wide in pixels
+	# (at the figure dpi, unless n_buckets is given); decimate=False plots
+	# every point
+	if decimate:
+		if n_buckets is None:
+			n_buckets = max(int(ax.bbox.width), 1)
+		x, y = decimate_minmax(x, y, n_buckets)
+	return ax.plot(x, y, *args, **kwargs)
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+#########################################################################################
+### Content-addressed store of derived results
+#########################################################################################
+# Results are kept in one JSON file as rows {'sample', 'temp', <result>: value}.
+# A row is addressed by a hash of the contents of its input files plus the
+# parameters it was computed with, so a row is reused as long as neither changes.
+# There is one row per (sample, temp); temp is None for per-sample fit results.
+# When the inputs of a sample or temperature change, its row is replaced.
+
+def _to_json(val):
+
+   if isinstance(val, np.ndarray):
+      return val.tolist()
+   if isinstance(val, np.generic):
+      return val.item()
+   return val
+
+def _from_json(val):
+
+   if isinstance(val, list):
+      return np.array(val, dtype=float)
+   return val
+
+class ResultStore:
+
+   def __init__(self, path="SdH_results.json"):
+
+      self.path = path
+      self.rows = {}
+      self.digests = {}
+
+      if os.path.exists(path):
+         with open(path) as f:
+            stored = json.load(f)
+         self.digests = stored['digests']
+         self.rows = {key: {name: _from_json(val) for name, val in row.items()}
+            for key, row in stored['rows'].items()}
+
+   def digest(self, fname):
+
+      # sha256 of the file contents, rehashed only when size or mtime change
+      st = os.stat(fname)
+      path = os.path.abspath(fname)
+      stamp = [st.st_size, st.st_mtime_ns]
+
+      if path not in self.digests or self.digests[path][:2] != stamp:
+         sha = hashlib.sha256()
+         with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+               sha.update(block)
+         self.digests[path] = stamp + [sha.hexdigest()]
+
+      return self.digests[path][2]
+
+   def key(self, fnames, params):
+
+      # params -- dict of the parameters the result depends on
+      sha = hashlib.sha256()
+      for fname in fnames:
+         sha.update(self.digest(fname).encode())
+      sha.update(json.dumps(params, sort_keys=True, default=_to_json).encode())
+      return sha.hexdigest()
+
+   def row(self, key, sample, temp=None):
+
+      # The row stored under key, or a new empty one replacing the previous
+      # row of (sample, temp). Results are added to the returned dict in place.
+      if key not in self.rows:
+         self.rows = {old_key: row for old_key, row in self.rows.items()
+            if (row['sample'], row['temp']) != (sample, temp)}
+         self.rows[key] = {'sample': sample, 'temp': temp}
+
+      return self.rows[key]
+
+   def table(self, *columns, **where):
+
+      # {column: array} over the rows that have all columns and match where,
+      # e.g. table('sample', 'm_c', temp=None) for the per-sample fits
+      rows = [row for row in self.rows.values()
+         if all(col in row for col in columns)
+         and all(row.get(col) == val for col, val in where.items())]
+
+      table = {}
+      for col in columns:
+         vals = [row[col] for row in rows]
+         if (any(isinstance(val, str) or val is None for val in vals)
+               or len({np.shape(val) for val in vals}) > 1):
+            # Labels, or arrays of different lengths
+            table[col] = np.empty(len(vals), dtype=object)
+            for ind, val in enumerate(vals):
+               table[col][ind] = val
+         else:
+            table[col] = np.array(vals, dtype=float)
+      return table
+
+   def save(self):
+
+      stored = {
+         'digests': self.digests,
+         'rows': {key: {name: _to_json(val) for name, val in row.items()}
+            for key, row in self.rows.items()},
+      }
+      tmp = f"{self.path}.{os.getpid()}.tmp"
+      with open(tmp, 'w') as f:
+         json.dump(stored, f, indent=1)
+      os.replace(tmp, self.path)
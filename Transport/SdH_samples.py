@@ -1,18 +1,7 @@
-import os
-import numpy as np
-import matplotlib.pyplot as plt
+from SdH_pipeline import SdHPipeline
+from SdH_results import ResultStore
 
-from scipy.signal import savgol_filter
-
-from SdH_func import (
-   epsilon,
-   moving_average,
-   remove_bg,
-   symmetrize,
-   find_extr
-)
-
-samples = {
+sample_params = {
    # "272": {
    #    'color': 'black',
    #    'label': r"Bi$_2$Se$_3$",
@@ -85,7 +74,6 @@ samples = {
    "367": {
       'color': 'black',
       'label': r"(FeSe)$_{0.1}$+Bi$_2$Se$_3$",
-      'data': {},
       "b_ind": 0,
       "x_ind": 1,
       "osc_shifts": [4e-3, 6e-3, 0, 2e-3],
@@ -95,10 +83,6 @@ samples = {
       'polyorder': 1,
       'deriv': 1,
       'n_extr': 10,
-      'mins': {},
-      'min_amps': {},
-      'maxs': {},
-      'max_amps': {},
       'expected_mins': [0.06523 + i*(0.06902-0.06523) for i in range(20)],
       'expected_maxs': [0.06717 + i*(0.07095-0.06717) for i in range(20)],
       'n0': 17,
@@ -110,55 +94,25 @@ samples = {
 #########################################################################################
 ### Load data
 #########################################################################################
-for num in samples.keys():
-
-   data_dir = f"RB_curves\\{num}"
-   hline_added = False
-
-   for ind, fname in enumerate(os.listdir(data_dir)):
-      temp = fname.removesuffix('.dat').removeprefix("T=")
-
-      # Extract raw data, interpolate and symmetrize
-      raw_data = np.loadtxt(f"{data_dir}\\{fname}", delimiter='\t').transpose()
-      b_ind = samples[num]["b_ind"]
-      x_ind = samples[num]["x_ind"]
-      grid, sym = symmetrize(raw_data[b_ind], epsilon(raw_data[b_ind], raw_data[x_ind]))
-
-      # Apply Savitzky-Golay filter
-      window_length = samples[num]['window_length']
-      polyorder = samples[num]['polyorder']
-      deriv = samples[num]['deriv']
-      sym_filt = savgol_filter(sym, window_length, polyorder, deriv)
-
-      # Trim data
-      max_field = samples[num]['max_field']
-      min_field = samples[num]['min_field']
-      grid, sym_filt = grid[grid<max_field], sym_filt[grid<max_field]
-      grid, sym_filt = grid[grid>min_field], sym_filt[grid>min_field]
-
-      # Load data to dict
-      samples[num]['data'][temp] = np.array([grid, sym_filt])
-
-      expected_mins = samples[num]['expected_mins']
-      expected_maxs = samples[num]['expected_maxs']
-      mins, min_amps = find_extr(1/grid, sym_filt, expected_mins)
-      maxs, max_amps = find_extr(1/grid, sym_filt, expected_maxs)
+# Nothing is computed here: samples[num]['data'|'mins'|...][temp] load and
+# process a curve on first access. samples.run() processes everything at once.
+# Extremums and fit results are kept in SdH_results.json and reused while the
+# data files and the processing parameters of a sample stay the same.
 
-      samples[num]['mins'][temp] = mins
-      samples[num]['maxs'][temp] = maxs
-      samples[num]['min_amps'][temp] = min_amps
-      samples[num]['max_amps'][temp] = max_amps
+# Number of worker processes for samples.run(): 1 -- serial, None -- one per core
+n_workers = 1
 
-      # plt.plot(grid, sym_filt, label=f"T={temp} K")
-      # plt.scatter(mins, min_amps, c='k')
-      # plt.scatter(maxs, max_amps, c='k')
+results = ResultStore("SdH_results.json")
+samples = SdHPipeline(sample_params, data_root="RB_curves", n_workers=n_workers,
+   results=results)
 
-      # if not hline_added:
-      #    for x in mins:
-      #       plt.axvline(x=x, ls='--', c='b')
-      #    for x in maxs:
-      #       plt.axvline(x=x, ls='--', c='r')
-      # hline_added = True
+# import matplotlib.pyplot as plt
+# for num in samples.keys():
+#    for temp in samples[num]['data'].keys():
+#       grid, sym_filt = samples[num]['data'][temp]
+#       plt.plot(grid, sym_filt, label=f"T={temp} K")
+#       plt.scatter(samples[num]['mins'][temp], samples[num]['min_amps'][temp], c='k')
+#       plt.scatter(samples[num]['maxs'][temp], samples[num]['max_amps'][temp], c='k')
 
 # plt.legend(loc='best')
 # plt.tight_layout()
@@ -0,0 +1,101 @@
+import io
+import json
+import os
+import zipfile
+
+import numpy as np
+
+from dat_cache import cache_paths, write_atomic
+
+#########################################################################################
+### Data folders backed by zip archives
+#########################################################################################
+# A data root holds sample folders, as extracted directories <root>/<name>/ and/or
+# archives <root>/<name>.zip. Files are addressed as "<name>/<member>" and read
+# from the directory when it has them, otherwise streamed from the archive, so
+# the extracted copies can be deleted. The member lists of all archives are
+# indexed once and kept in the data cache (see dat_cache) with the size and
+# mtime of every archive; only archives that changed are listed again.
+
+INDEX_NAME = "archives"
+
+class ArchiveSource:
+
+   def __init__(self, root, cache_dir=None):
+
+      self.root = root
+      self.index_path = cache_paths(os.path.join(root, INDEX_NAME), cache_dir)[1]
+      self.index = self._load_index()
+
+   def _load_index(self):
+
+      # {name: {'stamp': [size, mtime_ns], 'members': {member: path in archive}}}
+      try:
+         with open(self.index_path) as f:
+            stored = json.load(f)
+      except (OSError, ValueError):
+         stored = {}
+
+      index, changed = {}, False
+      for fname in sorted(os.listdir(self.root)):
+
+         if not fname.endswith('.zip'):
+            continue
+         name, path = fname[:-4], os.path.join(self.root, fname)
+         st = os.stat(path)
+         stamp = [st.st_size, st.st_mtime_ns]
+
+         if name in stored and stored[name]['stamp'] == stamp:
+            index[name] = stored[name]
+            continue
+
+         # Members by base name, archives may keep them in a subfolder
+         with zipfile.ZipFile(path) as archive:
+            members = {os.path.basename(info.filename): info.filename
+               for info in archive.infolist()
+               if not info.is_dir() and not info.filename.startswith('__MACOSX')}
+         index[name] = {'stamp': stamp, 'members': members}
+         changed = True
+
+      if changed or set(index) != set(stored):
+         os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+         write_atomic(self.index_path, lambda f: json.dump(index, f, indent=1))
+
+      return index
+
+   def names(self):
+
+      # Sample folders, extracted or archived
+      dirs = [fname for fname in os.listdir(self.root)
+         if os.path.isdir(os.path.join(self.root, fname))]
+      return sorted(set(dirs) | set(self.index))
+
+   def listdir(self, name):
+
+      # Files of one sample folder, from the directory and the archive
+      fnames = set(self.index.get(name, {}).get('members', {}))
+      folder = os.path.join(self.root, name)
+      if os.path.isdir(folder):
+         fnames |= set(os.listdir(folder))
+      return sorted(fnames)
+
+   def open(self, path):
+
+      # Binary file object of "<name>/<member>"
+      name, member = path.replace('\\', '/').split('/', 1)
+      fname = os.path.join(self.root, name, member)
+      if os.path.exists(fname):
+         return open(fname, 'rb')
+
+      members = self.index.get(name, {}).get('members', {})
+      if member not in members:
+         raise FileNotFoundError(f"{path} is neither in {self.root} nor in {name}.zip")
+
+      # The member is read whole, scans and logs are small next to the archive
+      with zipfile.ZipFile(os.path.join(self.root, name + '.zip')) as archive:
+         return io.BytesIO(archive.read(members[member]))
+
+   def loadtxt(self, path, **loadtxt_kwargs):
+
+      with io.TextIOWrapper(self.open(path), encoding='utf-8', errors='replace') as f:
+         return np.loadtxt(f, **loadtxt_kwargs)
@@ -0,0 +1,93 @@
+import json
+import os
+
+import numpy as np
+
+#########################################################################################
+### Binary cache for text data files
+#########################################################################################
+# load_dat parses a text file with np.loadtxt once and stores the result as .npy
+# in a cache directory (by default __datacache__ next to the file's folder).
+# Later calls open the .npy with np.load(mmap_mode=...). A small .json stamp
+# next to the cache file records the source size, mtime and loadtxt arguments;
+# any change triggers a re-parse.
+
+CACHE_DIR_NAME = "__datacache__"
+
+def cache_paths(fname, cache_dir=None):
+
+   # (.npy, .json) cache paths of fname. The cache lives outside of the data
+   # folder, so that os.listdir of a data folder keeps returning data files
+   # only. Files with equal names from different folders are kept apart by a
+   # subfolder per data folder.
+   src_dir, base = os.path.split(os.path.abspath(fname))
+   if cache_dir is None:
+      cache_dir = os.path.join(os.path.dirname(src_dir), CACHE_DIR_NAME)
+   cache_dir = os.path.join(cache_dir, os.path.basename(src_dir))
+
+   return os.path.join(cache_dir, base + ".npy"), os.path.join(cache_dir, base + ".json")
+
+def _stamp(fname, loadtxt_kwargs):
+
+   st = os.stat(fname)
+   return {
+      'size': st.st_size,
+      'mtime_ns': st.st_mtime_ns,
+      'loadtxt': repr(sorted(loadtxt_kwargs.items())),
+   }
+
+def write_atomic(path, write, mode='w'):
+
+   # write(f) into a temporary file that then replaces path, so readers
+   # never see a partly written file
+   tmp = f"{path}.{os.getpid()}.tmp"
+   try:
+      with open(tmp, mode) as f:
+         write(f)
+      os.replace(tmp, path)
+   finally:
+      if os.path.exists(tmp):
+         os.remove(tmp)
+
+def is_cached(fname, cache_dir=None, **loadtxt_kwargs):
+
+   npy_path, stamp_path = cache_paths(fname, cache_dir)
+   if not (os.path.exists(npy_path) and os.path.exists(stamp_path)):
+      return False
+
+   try:
+      with open(stamp_path) as f:
+         return json.load(f) == _stamp(fname, loadtxt_kwargs)
+   except (OSError, ValueError):
+      return False
+
+def load_dat(fname, mmap_mode='r', cache_dir=None, **loadtxt_kwargs):
+
+   # Returns the same (rows, cols) array as np.loadtxt(fname, **loadtxt_kwargs).
+   # It is stored in Fortran order, so data.transpose() is C-contiguous.
+   # Use mmap_mode='c' for an array that may be modified in memory and
+   # mmap_mode=None to read it fully into memory.
+   npy_path, stamp_path = cache_paths(fname, cache_dir)
+
+   if not is_cached(fname, cache_dir, **loadtxt_kwargs):
+
+      stamp = _stamp(fname, loadtxt_kwargs)
+      data = np.asfortranarray(np.loadtxt(fname, **loadtxt_kwargs))
+
+      os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+      write_atomic(npy_path, lambda f: np.save(f, data), mode='wb')
+      write_atomic(stamp_path, lambda f: json.dump(stamp, f))
+
+      # The source changed while it was parsed, so the stamp may be stale
+      if stamp != _stamp(fname, loadtxt_kwargs):
+         os.remove(stamp_path)
+
+   return np.load(npy_path, mmap_mode=mmap_mode)
+
+def clear_cache(data_dir, cache_dir=None):
+
+   # Remove cache entries of all files in data_dir
+   for fname in os.listdir(data_dir):
+      for path in cache_paths(os.path.join(data_dir, fname), cache_dir):
+         if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,105 @@
+import re
+
+import numpy as np
+
+from raw_data import read_header, read_columns
+
+#########################################################################################
+### Lock-in channels of the logger files
+#########################################################################################
+# One log records all lock-ins of a cooldown. A lock-in <ch> writes V_<ch>_X,
+# V_<ch>_Y, V_<ch>_R, V_<ch>_theta, Freq_<ch>, Harm_<ch> and, for the lock-in
+# whose sine output drives the current, Vout_<ch>. The current through a
+# sample is the output amplitude over the series resistor (the sample
+# resistance is negligible next to it).
+
+COMPONENTS = ('X', 'Y', 'R', 'theta')
+
+# Columns shared by all channels, taken along where the log has them
+COMMON_COLUMNS = ('time', 'abs_time', 'angle', 'Tsample', 'Magnet_output_field',
+   'Magnet_magnet_field')
+
+WIRING = {
+   # SdH_raw_data/367/README.txt, schemes 1 and 2: lock-in channel ->
+   # sample, contact pair and its contacts, series resistor [Ohm], output
+   # amplitude [V] as a number, the Vout column or None if not known
+   "367, scheme 1": {
+      '367-x': {'sample': '367-a', 'pair': 'xx', 'contacts': (4, 9), 'resistor': 10e3,
+         'v_out': 'Vout_367-x'},
+      '367-y': {'sample': '367-a', 'pair': 'xy', 'contacts': (4, 5), 'resistor': 10e3,
+         'v_out': 'Vout_367-x'},
+      # The 363-b lock-in does not log its output and the README does not
+      # give it: voltages only
+      '363-x': {'sample': '363-b', 'pair': 'xx', 'contacts': (17, 16), 'resistor': 14.5e3,
+         'v_out': None},
+   },
+   "367, scheme 2": {
+      '367-x': {'sample': '367-a', 'pair': 'xx', 'contacts': (5, 7), 'resistor': 10e3,
+         'v_out': 'Vout_367-x'},
+      '367-y': {'sample': '367-a', 'pair': 'xy', 'contacts': (4, 5), 'resistor': 10e3,
+         'v_out': 'Vout_367-x'},
+      '363-x': {'sample': '363-b', 'pair': 'xx', 'contacts': (17, 16), 'resistor': 14.5e3,
+         'v_out': None},
+   },
+}
+
+def lockin_channels(header):
+
+   # Lock-in channel names of a log header, in the order of the columns
+   channels = []
+   for col in header:
+      match = re.fullmatch(r"V_(.+)_X", col)
+      if match:
+         channels.append(match.group(1))
+   return channels
+
+def channel_columns(ch, header):
+
+   # {field: column} of one lock-in channel, only those present in header
+   cols = {comp: f"V_{ch}_{comp}" for comp in COMPONENTS}
+   cols.update(freq=f"Freq_{ch}", harm=f"Harm_{ch}")
+   return {key: col for key, col in cols.items() if col in header}
+
+#########################################################################################
+### Demultiplexer
+#########################################################################################
+def demux(fname, wiring, chunk_size=100000):
+
+   # Reads fname once and splits it per sample and contact pair:
+   # ({sample: {pair: {'X', 'Y', 'R', 'theta', 'freq', 'harm', 'current',
+   # 'R_X', 'R_Y', 'contacts', 'channel'}}}, {common column: array}).
+   # Voltages in V, current in A, resistances R_X, R_Y = X/I, Y/I in Ohm;
+   # current, R_X and R_Y only for channels with a known v_out.
+   # Channels of the log missing from wiring are skipped.
+   header = read_header(fname)
+   channels = [ch for ch in lockin_channels(header) if ch in wiring]
+
+   columns = [col for col in COMMON_COLUMNS if col in header]
+   for ch in channels:
+      columns += channel_columns(ch, header).values()
+      v_out = wiring[ch]['v_out']
+      if isinstance(v_out, str) and v_out not in columns:
+         columns.append(v_out)
+
+   data = read_columns(fname, columns, chunk_size)
+
+   samples = {}
+   for ch in channels:
+
+      conf = wiring[ch]
+      pair = {key: data[col] for key, col in channel_columns(ch, header).items()}
+      pair.update(channel=ch, contacts=conf['contacts'])
+
+      if conf['v_out'] is not None:
+         v_out = data[conf['v_out']] if isinstance(conf['v_out'], str) else conf['v_out']
+         current = np.broadcast_to(np.asarray(v_out, dtype=float)/conf['resistor'],
+            data[columns[0]].shape)
+         pair['current'] = current
+         if 'X' in pair:
+            pair['R_X'] = pair['X']/current
+         if 'Y' in pair:
+            pair['R_Y'] = pair['Y']/current
+      samples.setdefault(conf['sample'], {})[conf['pair']] = pair
+
+   common = {col: data[col] for col in COMMON_COLUMNS if col in data}
+   return samples, common
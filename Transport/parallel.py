@@ -0,0 +1,19 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+#########################################################################################
+### Process pool for independent jobs
+#########################################################################################
+# Shared by the SdH pipeline, its bootstrap and angle analysis and the X-ray
+# rocking curve fits. func and the jobs must be picklable (module level).
+
+def run_jobs(func, jobs, n_workers):
+
+   # [func(job) for job in jobs], in n_workers processes. Worker processes
+   # started with 'spawn' re-import the main script; running serially there
+   # keeps them from starting pools of their own
+   if n_workers == 1 or len(jobs) < 2 or multiprocessing.parent_process() is not None:
+      return [func(job) for job in jobs]
+
+   with ProcessPoolExecutor(max_workers=n_workers) as pool:
+      return list(pool.map(func, jobs))
@@ -0,0 +1,164 @@
+import datetime
+import json
+import os
+import re
+
+import numpy as np
+
+from raw_data import open_log, parse_header
+
+#########################################################################################
+### Catalog of the logger files
+#########################################################################################
+# Logs are named data---<procedure>---[k=v,...]---YYYY-MM-DD---HH-MM-SS.txt, or
+# YYYY-MM-DD---HH-MM-SS---data---<procedure>---[k=v,...].txt in the 2024 runs.
+# The catalog parses every name and header once and keeps the result in a
+# JSON index with the size and mtime of each file. Opening the catalog only
+# stats the tree: new and changed files are parsed, removed ones dropped.
+# Queries run on the index without opening data files.
+
+def _number(val):
+
+   try:
+      return float(val)
+   except ValueError:
+      return val
+
+def parse_name(fname):
+
+   # {'procedure', 'params', 'started'} from a log name. Other names (the 21T
+   # runs, T=3_theta=90.txt) give the stem as procedure and their k=v parts.
+   stem = os.path.splitext(os.path.basename(fname))[0]
+   match = re.search(r"data---(.+?)---\[(.*?)\]", stem)
+   if match:
+      procedure, params = match.group(1), match.group(2).split(',')
+   else:
+      procedure, params = stem, re.findall(r"[A-Za-z]\w*=[-+\d.]+", stem)
+
+   started = re.search(r"(\d{4}-\d{2}-\d{2})---(\d{2})-(\d{2})-(\d{2})", stem)
+   if started:
+      started = datetime.datetime.fromisoformat(f"{started.group(1)}T{':'.join(started.groups()[1:])}")
+      started = started.isoformat()
+
+   return {
+      'procedure': procedure,
+      'params': {key.strip(): _number(val) for key, val in
+         (param.split('=', 1) for param in params if '=' in param)},
+      'started': started,
+   }
+
+def column_samples(columns):
+
+   # Sample numbers of the measured channels: V_367-x_X, 272x_Ch1, Vout371y
+   samples = set()
+   for col in columns:
+      match = re.match(r"(?:V_|Vout_?|Freq_)?(\d{3})(?:[-_]?[xy])?(?:_|$)", col)
+      if match:
+         samples.add(match.group(1))
+   return sorted(samples)
+
+def scan_file(fname):
+
+   # Name fields plus columns, row count, abs_time range and samples
+   entry = parse_name(fname)
+   with open_log(fname) as f:
+      columns, delimiter = parse_header(f)
+      first = last = None
+      rows = 0
+      for line in f:
+         if line.strip():
+            first = line if first is None else first
+            last = line
+            rows += 1
+
+   entry.update(columns=columns, rows=rows, time_range=None)
+   if 'abs_time' in columns and rows:
+      ind = columns.index('abs_time')
+      try:
+         entry['time_range'] = [float(line.split(delimiter)[ind]) for line in (first, last)]
+      except (ValueError, IndexError):
+         pass
+
+   folder_samples = re.findall(r"\b(\d{3})\b", os.path.dirname(fname))
+   entry['samples'] = sorted(set(column_samples(columns)) | set(folder_samples))
+   return entry
+
+class RawCatalog:
+
+   def __init__(self, root=os.path.join("..", "SdH_raw_data"), path="SdH_catalog.json"):
+
+      self.root = root
+      self.path = path
+      try:
+         with open(path) as f:
+            self.entries = json.load(f)
+      except (OSError, ValueError):
+         self.entries = {}
+      self.update()
+
+   def update(self):
+
+      # Parses the files that are new or changed since the last update
+      seen, changed = set(), False
+      for dirpath, dirnames, fnames in os.walk(self.root):
+         dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+         for fname in fnames:
+
+            if not fname.endswith('.txt') or fname.lower().startswith('readme'):
+               continue
+            path = os.path.join(dirpath, fname)
+            rel = os.path.relpath(path, self.root)
+            st = os.stat(path)
+            stamp = [st.st_size, st.st_mtime_ns]
+            seen.add(rel)
+
+            if rel not in self.entries or self.entries[rel]['stamp'] != stamp:
+               self.entries[rel] = dict(scan_file(path), stamp=stamp)
+               changed = True
+
+      for rel in set(self.entries) - seen:
+         del self.entries[rel]
+         changed = True
+
+      if changed:
+         self.save()
+
+   def save(self):
+
+      tmp = f"{self.path}.{os.getpid()}.tmp"
+      with open(tmp, 'w') as f:
+         json.dump(self.entries, f, indent=1)
+      os.replace(tmp, self.path)
+
+   def query(self, procedure=None, sample=None, columns=(), **params):
+
+      # Paths (relative to root) of the logs whose procedure contains
+      # procedure, with sample among their samples, all columns, and params
+      # matching: a value for equality, a (low, high) pair for a range with
+      # None as an open end, e.g. query('R(H)', '367', T=(None, 3), phi=177)
+      def matches(entry):
+         if procedure is not None and procedure not in entry['procedure']:
+            return False
+         if sample is not None and sample not in entry['samples']:
+            return False
+         if not all(col in entry['columns'] for col in columns):
+            return False
+         for key, cond in params.items():
+            val = entry['params'].get(key)
+            if not isinstance(val, float):
+               # Labels such as field=up compare as they are
+               if val is None or val != cond:
+                  return False
+            elif isinstance(cond, tuple):
+               low, high = cond
+               if (low is not None and val < low) or (high is not None and val > high):
+                  return False
+            elif not isinstance(cond, (int, float)) or not np.isclose(val, cond):
+               return False
+         return True
+
+      return sorted(rel for rel, entry in self.entries.items() if matches(entry))
+
+   def path_of(self, rel):
+
+      return os.path.join(self.root, rel)
@@ -0,0 +1,135 @@
+import itertools
+
+import numpy as np
+
+#########################################################################################
+### Logger files from SdH_raw_data
+#########################################################################################
+# The acquisition logs are comma separated (2021 runs) or tab separated (21T
+# runs) text files with one header line of column names. Newer logs start with
+# a '#' preamble describing the instruments. The readers below parse the header
+# once and convert only the requested columns, chunk by chunk.
+
+def open_log(fname):
+
+   # Text mode, undecodable bytes of the instrument preambles replaced
+   return open(fname, 'r', encoding='utf-8', errors='replace')
+
+def parse_header(f):
+
+   # (columns, delimiter) of a log opened with open_log, f left at the first
+   # data line
+   for line in f:
+      if line.startswith('#') or not line.strip():
+         continue
+      line = line.rstrip('\r\n')
+      delimiter = ',' if ',' in line else '\t'
+      return [name.strip() for name in line.split(delimiter)], delimiter
+
+   return [], ','
+
+def read_header(fname):
+
+   with open_log(fname) as f:
+      columns, _ = parse_header(f)
+   return columns
+
+def _column_indices(fname, header, columns):
+
+   missing = [col for col in columns if col not in header]
+   if missing:
+      raise ValueError(f"{fname}: no columns {missing}, available: {header}")
+   return [header.index(col) for col in columns]
+
+def iter_columns(fname, columns, chunk_size=100000, dtype=float):
+
+   # Yields (rows, len(columns)) arrays of at most chunk_size rows, columns in
+   # the requested order
+   with open_log(fname) as f:
+
+      header, delimiter = parse_header(f)
+      usecols = _column_indices(fname, header, columns)
+
+      while True:
+         lines = list(itertools.islice(f, chunk_size))
+         if not lines:
+            break
+
+         block = np.loadtxt(lines, delimiter=delimiter, usecols=usecols,
+            dtype=dtype, ndmin=2)
+         if len(block):
+            yield block
+
+def read_columns(fname, columns, chunk_size=100000, dtype=float):
+
+   # Dict of 1-D arrays, one per requested column
+   blocks = list(iter_columns(fname, columns, chunk_size, dtype))
+   if blocks:
+      data = np.ascontiguousarray(np.concatenate(blocks).transpose())
+   else:
+      data = np.empty((len(columns), 0), dtype=dtype)
+
+   return {col: data[ind] for ind, col in enumerate(columns)}
+
+#########################################################################################
+### Field sweeps
+#########################################################################################
+# R(H) logs hold several back-to-back field ramps with dwell sections between
+# them. The magnet reports its field in steps, so the sweep direction is taken
+# from the rate over a window of points. A ramp starts where |dB/dt| rises above
+# rate_high and lasts until it falls below rate_low (hysteresis), or until the
+# sign of dB/dt flips.
+
+def sweep_labels(time, field, window=10, rate_high=2e-4, rate_low=5e-5):
+
+   # +1 (up), -1 (down) or 0 (dwell) for every point; rates in field units/s
+   n = len(field)
+   lo = np.maximum(np.arange(n) - window, 0)
+   hi = np.minimum(np.arange(n) + window, n - 1)
+   with np.errstate(divide='ignore', invalid='ignore'):
+      rate = (field[hi] - field[lo])/(time[hi] - time[lo])
+   rate = np.nan_to_num(rate)
+
+   # Points outside the hysteresis band decide, the others keep the last decision
+   decided = (np.abs(rate) > rate_high) | (np.abs(rate) < rate_low)
+   state = np.where(np.abs(rate) > rate_high, np.sign(rate), 0).astype(int)
+   last = np.maximum.accumulate(np.where(decided, np.arange(n), 0))
+   return np.where(decided[0] | (last > 0), state[last], 0)
+
+def sweep_bounds(labels, field, min_points=20, min_span=0.02):
+
+   # [(start, stop, direction)] of the runs of equal nonzero label with at
+   # least min_points points spanning at least min_span in field. The field
+   # readback of a dwell wanders by up to ~7 mT, which the rate thresholds
+   # alone take for short ramps; the shortest real ramps span ~40 mT.
+   edges = np.flatnonzero(np.diff(labels)) + 1
+   starts = np.concatenate([[0], edges])
+   stops = np.concatenate([edges, [len(labels)]])
+   keep = (labels[starts] != 0) & (stops - starts >= min_points)
+
+   bounds = []
+   for start, stop in zip(starts[keep], stops[keep]):
+
+      # The rate window blurs the turning points, cut the run between its
+      # field extremums
+      seg = field[start:stop]*labels[start]
+      start, stop = start + np.argmin(seg), start + np.argmax(seg) + 1
+      if stop - start >= min_points and np.ptp(field[start:stop]) >= min_span:
+         bounds.append((start, stop, 'up' if labels[start] > 0 else 'down'))
+   return bounds
+
+def split_sweeps(data, field_col='Magnet_output_field', time_col='abs_time', min_points=20,
+   min_span=0.02, **label_kwargs):
+
+   # Monotonic sweeps of a read_columns dict, dwells dropped. Returns
+   # [{'direction': 'up' | 'down', column: view}]; the arrays are slices of
+   # the columns, not copies.
+   labels = sweep_labels(data[time_col], data[field_col], **label_kwargs)
+   return [dict({col: vals[start:stop] for col, vals in data.items()}, direction=direction)
+      for start, stop, direction in sweep_bounds(labels, data[field_col], min_points, min_span)]
+
+def read_sweeps(fname, columns, field_col='Magnet_output_field', time_col='abs_time', **kwargs):
+
+   # read_columns + split_sweeps; field_col and time_col are read as well
+   extra = [col for col in (time_col, field_col) if col not in columns]
+   return split_sweeps(read_columns(fname, list(columns) + extra), field_col, time_col, **kwargs)
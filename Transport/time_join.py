@@ -0,0 +1,96 @@
+import numpy as np
+
+from raw_data import read_header, read_columns
+
+#########################################################################################
+### Time-indexed logs
+#########################################################################################
+# Temperature runs, field ramps and R(H) sweeps are logged to separate files
+# that share the abs_time column (unix time, s). A TimeStore keeps named
+# streams, each sorted by abs_time, and looks values of one stream up at the
+# timestamps of another with searchsorted: the last value at or before a time
+# (as-of join) or linear interpolation between neighbouring rows.
+
+class TimeStore:
+
+   def __init__(self, time_col='abs_time'):
+
+      self.time_col = time_col
+      self.streams = {}
+
+   def add(self, name, data):
+
+      # data -- {column: array} with the time column; merged into the stream
+      # name if it exists, the result sorted by time. Columns only one side
+      # has are kept, NaN on the rows of the other side.
+      if name in self.streams:
+         old = self.streams[name]
+         n_old, n_new = len(old[self.time_col]), len(data[self.time_col])
+         merged = {}
+         for col in list(old) + [col for col in data if col not in old]:
+            merged[col] = np.concatenate([
+               np.asarray(old[col], dtype=float) if col in old else np.full(n_old, np.nan),
+               np.asarray(data[col], dtype=float) if col in data else np.full(n_new, np.nan)])
+         data = merged
+
+      order = np.argsort(data[self.time_col], kind='stable')
+      if np.all(order[1:] > order[:-1]):
+         self.streams[name] = {col: np.asarray(vals) for col, vals in data.items()}
+      else:
+         self.streams[name] = {col: np.asarray(vals)[order] for col, vals in data.items()}
+
+   def add_files(self, name, fnames, columns):
+
+      # Appends the columns of the logs to the stream name; logs lacking
+      # any of them are skipped. Returns the files that were read.
+      columns = [self.time_col] + [col for col in columns if col != self.time_col]
+      used = [fname for fname in fnames if all(col in read_header(fname) for col in columns)]
+      if used:
+         blocks = [read_columns(fname, columns) for fname in used]
+         self.add(name, {col: np.concatenate([block[col] for block in blocks]) for col in columns})
+      return used
+
+   def span(self, name):
+
+      time = self.streams[name][self.time_col]
+      return time[0], time[-1]
+
+   def window(self, name, start, stop):
+
+      # Rows of the stream with start <= time < stop, as views
+      stream = self.streams[name]
+      lo, hi = np.searchsorted(stream[self.time_col], [start, stop], 'left')
+      return {col: vals[lo:hi] for col, vals in stream.items()}
+
+   def asof(self, name, times, columns, tolerance=np.inf):
+
+      # {column: array} of the last row of stream name at or before every
+      # time; NaN before the first row or when that row is older than tolerance
+      stream = self.streams[name]
+      time = stream[self.time_col]
+      times = np.asarray(times, dtype=float)
+
+      ind = np.searchsorted(time, times, 'right') - 1
+      found = (ind >= 0) & (times - time[np.maximum(ind, 0)] <= tolerance)
+      ind = np.maximum(ind, 0)
+      return {col: np.where(found, stream[col][ind], np.nan) for col in columns}
+
+   def interp(self, name, times, columns, max_gap=np.inf):
+
+      # {column: array} of stream name linearly interpolated at times; NaN
+      # outside the stream and inside gaps between rows longer than max_gap
+      stream = self.streams[name]
+      time = stream[self.time_col]
+      times = np.asarray(times, dtype=float)
+
+      ind = np.clip(np.searchsorted(time, times, 'right'), 1, len(time) - 1)
+      t0, t1 = time[ind - 1], time[ind]
+      inside = (times >= time[0]) & (times <= time[-1]) & (t1 - t0 <= max_gap)
+
+      with np.errstate(divide='ignore', invalid='ignore'):
+         w = np.where(t1 > t0, (times - t0)/(t1 - t0), 0)
+      result = {}
+      for col in columns:
+         vals = stream[col]
+         result[col] = np.where(inside, vals[ind - 1] + w*(vals[ind] - vals[ind - 1]), np.nan)
+      return result
@@ -1,4 +1,6 @@
 import math
+import os
+import sys
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
@@ -18,6 +20,9 @@ visible_ticks = {
 
 from matplotlib.ticker import AutoMinorLocator
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Transport'))
+from archive_data import ArchiveSource
+
 ####################################################################################
 ####################################################################################
 ### Fe_samples
@@ -44,15 +49,18 @@ A_err = np.array([val[4] for val in Fe_samples.values()])
 ####################################################################################
 ### Load data
 ####################################################################################
-diffr_272 = np.transpose(np.loadtxt("data\\272\\272_Diffr.txt"))
-diffr_367 = np.transpose(np.loadtxt("data\\367\\367_Diffr.txt"))
-diffr_370 = np.transpose(np.loadtxt("data\\370\\370_Diffr_Poly.txt"))
-diffr_371 = np.transpose(np.loadtxt("data\\371\\371_Diffr.txt"))
-
-scan_272 = np.transpose(np.loadtxt("data\\272\\Bi2Se3_272_(0015)_phi_220.2_(2q_w).txt"))
-scan_363 = np.transpose(np.loadtxt("data\\363-s1\\363-s1_(0015)_(2q_w).txt"))
-scan_367 = np.transpose(np.loadtxt("data\\367\\367_(0015)_X_-2.6_(2q_w).txt"))
-scan_371 = np.transpose(np.loadtxt("data\\371\\371_(0015)_X_0.84_(2q_w).txt"))
+# Extracted folders of data/ or their zip archives
+data = ArchiveSource("data")
+
+diffr_272 = np.transpose(data.loadtxt("272/272_Diffr.txt"))
+diffr_367 = np.transpose(data.loadtxt("367/367_Diffr.txt"))
+diffr_370 = np.transpose(data.loadtxt("370/370_Diffr_Poly.txt"))
+diffr_371 = np.transpose(data.loadtxt("371/371_Diffr.txt"))
+
+scan_272 = np.transpose(data.loadtxt("272/Bi2Se3_272_(0015)_phi_220.2_(2q_w).txt"))
+scan_363 = np.transpose(data.loadtxt("363-s1/363-s1_(0015)_(2q_w).txt"))
+scan_367 = np.transpose(data.loadtxt("367/367_(0015)_X_-2.6_(2q_w).txt"))
+scan_371 = np.transpose(data.loadtxt("371/371_(0015)_X_0.84_(2q_w).txt"))
 
 ####################################################################################
 ### Figure and grids
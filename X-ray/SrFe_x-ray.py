@@ -24,14 +24,14 @@ from matplotlib.ticker import AutoMinorLocator
 SrFe_samples = {
 	# key -- sample number, (sr content, c, c_err, a, a_err, n, mu)
 	'350':	(0, 28.65645, 0.00237, 4.14099, 9.7018E-4),
-	'360':	(0.002, 28.6408, 0.00255, np.NaN, np.NaN),
-	'362':	(0.003, np.NaN, np.NaN, np.NaN, np.NaN),
-	'359':	(0.004, 28.6367, 0.00156, 4.1414, np.NaN),
+	'360':	(0.002, 28.6408, 0.00255, np.nan, np.nan),
+	'362':	(0.003, np.nan, np.nan, np.nan, np.nan),
+	'359':	(0.004, 28.6367, 0.00156, 4.1414, np.nan),
 	'364':	(0.005, 28.6426, 0, 4.14088,	4.42531E-4),
 	'361':	(0.006, 28.63528, 0.00469, 4.14099, 4.8795E-4),
-	'357':	(0.01, np.NaN, np.NaN, np.NaN, np.NaN),
-	'356':	(0.0245, np.NaN, np.NaN, np.NaN, np.NaN),
-	'355':	(0.06, np.NaN, np.NaN, np.NaN, np.NaN),
+	'357':	(0.01, np.nan, np.nan, np.nan, np.nan),
+	'356':	(0.0245, np.nan, np.nan, np.nan, np.nan),
+	'355':	(0.06, np.nan, np.nan, np.nan, np.nan),
 }
 
 
@@ -0,0 +1,333 @@
+import os
+import re
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Transport'))
+from archive_data import ArchiveSource
+from SdH_func import lm_batch
+
+wavelength = 1.5406 # Cu K_alpha1 [A]
+
+# Nominal Bi2Se3 lattice, used to predict where the reflections are
+c_nominal = 28.64 # [A]
+a_nominal = 4.14 # [A]
+
+# Half width of the fit window around each peak of a wide scan [deg]
+window = 0.4
+
+####################################################################################
+### Scan files
+####################################################################################
+# Wide 2theta scans are <sample>_Diffr*.txt, single reflection 2theta/omega
+# scans carry the reflection and '(2q_w)' in the name, e.g.
+# 367_(205)_phi_200.9_(2q_w).txt. Reflections are written as h, k and l
+# digits in a row: (0015) is (0, 0, 15), (0210) is (0, 2, 10).
+
+def parse_hkl(fname):
+
+   # (h, k, l) of the first parenthesized reflection in fname, or None. A few
+   # files miss the closing parenthesis, as in 371_(1010Par1_...
+   match = re.search(r"\((\d)(\d)(\d+)", os.path.basename(fname))
+   if match is None:
+      return None
+   return tuple(int(ind) for ind in match.groups())
+
+def scan_files(source, name):
+
+   # [(kind, hkl, path)] of the sample folder name of an ArchiveSource, with
+   # kind 'wide' or '2q_w'
+   scans = []
+   for fname in source.listdir(name):
+      path = f"{name}/{fname}"
+      if re.search(r"_Diffr.*\.txt$", fname):
+         scans.append(('wide', None, path))
+      elif re.search(r"\(2q_w\)\w*\.txt$", fname) and parse_hkl(fname) is not None:
+         scans.append(('2q_w', parse_hkl(fname), path))
+   return scans
+
+####################################################################################
+### Bragg angles
+####################################################################################
+def d_spacing(hkl, c, a):
+
+   # Hexagonal lattice
+   h, k, l = hkl
+   return 1/np.sqrt(4/3*(h**2 + h*k + k**2)/a**2 + l**2/c**2)
+
+def two_theta(d):
+
+   return 2*np.degrees(np.arcsin(wavelength/(2*d)))
+
+def d_from_two_theta(tth):
+
+   return wavelength/(2*np.sin(np.radians(tth)/2))
+
+####################################################################################
+### Pseudo-Voigt profiles
+####################################################################################
+# Every peak has (amp, center, fwhm, eta) and its own linear background
+# (b0, b1) over its fit window, so PARS = 6 parameters per peak.
+PARS = 6
+
+def pseudo_voigt(x, amp, center, fwhm, eta):
+
+   u = 2*(x - center)/fwhm
+   return amp*(eta/(1 + u**2) + (1 - eta)*np.exp(-np.log(2)*u**2))
+
+def _peaks_model(x, seg, centers0, n_peaks):
+
+   # Model and Jacobian over the stacked scans, all peaks of a scan together.
+   # x, seg -- (n_scans, n_points) angles and the peak window of each point,
+   # centers0 -- (n_scans, n_peaks) window centers of the backgrounds.
+   # The fit runs in (amp, center, ln(fwhm), logit(eta), b0, b1), so that
+   # fwhm > 0 and 0 < eta < 1 hold without abs or clip (see fit_scans).
+   def model(p):
+      p = p.reshape(len(x), n_peaks, PARS)
+      amp, center, ln_fwhm, logit_eta, b0, b1 = [p[..., ind, None] for ind in range(PARS)]
+      fwhm = np.exp(ln_fwhm)
+      eta = 0.5*(1 + np.tanh(logit_eta/2))
+
+      u = 2*(x[:, None, :] - center)/fwhm
+      lor = 1/(1 + u**2)
+      gauss = np.exp(-np.log(2)*u**2)
+      du_prof = eta*(-2*u*lor**2) + (1 - eta)*(-2*np.log(2)*u*gauss)
+
+      own = seg[:, None, :] == np.arange(n_peaks)[None, :, None]
+      dx = x[:, None, :] - centers0[..., None]
+
+      jac = np.stack([
+         eta*lor + (1 - eta)*gauss,
+         amp*du_prof*(-2/fwhm),
+         amp*du_prof*(-u),
+         amp*(lor - gauss)*eta*(1 - eta),
+         own*1.0,
+         own*dx,
+      ], axis=-1)
+      val = np.sum(amp*(eta*lor + (1 - eta)*gauss) + own*(b0 + b1*dx), axis=1)
+
+      # (n_scans, n_peaks, n_points, PARS) -> (n_scans, n_points, n_peaks*PARS)
+      return val, jac.transpose(0, 2, 1, 3).reshape(len(x), x.shape[1], -1)
+
+   return model
+
+def _initial_peak(x, y):
+
+   # (amp, center, fwhm, eta, b0, b1) from the maximum and the half maximum
+   # crossings of one window
+   bg = np.min(y)
+   top = np.argmax(y)
+   half = y >= bg + (y[top] - bg)/2
+   fwhm = max(np.ptp(x[half]), 2*np.median(np.diff(x)))
+   return [y[top] - bg, x[top], fwhm, 0.5, bg, 0]
+
+def find_peaks(x, y, positions, min_counts=10):
+
+   # Window centers among the expected positions where the scan shows a peak
+   # that is at least min_counts and 5 standard deviations above the window
+   found = []
+   for pos in positions:
+      inside = np.abs(x - pos) < window
+      if np.sum(inside) < 10:
+         continue
+      ys = y[inside]
+      bg = np.median(np.concatenate([ys[:3], ys[-3:]]))
+      if ys.max() - bg > max(min_counts, 5*np.sqrt(max(bg, 1))):
+         found.append(x[inside][np.argmax(ys)])
+   return found
+
+def fit_scans(scans, half_width=window):
+
+   # scans -- [(x, y, [window centers])], the points within half_width of a
+   # center are fitted. Scans with the same number of peaks are fitted in one
+   # batch; counts are weighted by 1/sqrt(counts).
+   # Returns [(popt, perr)] of shape (n_peaks, PARS) per scan.
+   results = [None]*len(scans)
+   groups = {}
+   for ind, (_, _, centers) in enumerate(scans):
+      if centers:
+         groups.setdefault(len(centers), []).append(ind)
+
+   for n_peaks, inds in groups.items():
+
+      # Points of all peak windows of a scan, padded to the longest scan
+      rows = []
+      for ind in inds:
+         x, y, centers = scans[ind]
+         dist = np.abs(x[:, None] - np.array(centers)[None, :])
+         seg = np.argmin(dist, axis=1)
+         inside = dist[np.arange(len(x)), seg] < half_width
+         rows.append((x[inside], y[inside], seg[inside], centers))
+
+      size = max(len(row[0]) for row in rows)
+      X = np.zeros((len(rows), size))
+      Y = np.zeros((len(rows), size))
+      seg = np.zeros((len(rows), size), dtype=int)
+      valid = np.zeros((len(rows), size), dtype=bool)
+      p0 = np.zeros((len(rows), n_peaks*PARS))
+      for row, (x, y, s, centers) in enumerate(rows):
+         n = len(x)
+         X[row, :n], Y[row, :n], seg[row, :n], valid[row, :n] = x, y, s, True
+         X[row, n:] = x[-1]
+         p0[row] = np.concatenate([_initial_peak(x[s == k], y[s == k]) for k in range(n_peaks)])
+         p0[row, 5::PARS] = 0
+      p0[:, 2::PARS] = np.log(p0[:, 2::PARS])
+      p0[:, 3::PARS] = np.log(p0[:, 3::PARS]/(1 - p0[:, 3::PARS]))
+      centers0 = np.array([row[3] for row in rows])
+
+      # Poisson weights
+      sigma = np.sqrt(np.maximum(Y, 1))
+      model = _peaks_model(X, seg, centers0, n_peaks)
+
+      def weighted(p):
+         val, jac = model(p)
+         return val/sigma, jac/sigma[..., None]
+
+      popt, pcov = lm_batch(weighted, p0, np.where(valid, Y/sigma, np.nan), valid)
+      perr = np.sqrt(np.abs(np.diagonal(pcov, axis1=1, axis2=2)))
+
+      for row, ind in enumerate(inds):
+
+         # Back to fwhm and eta, errors through the derivatives
+         pars, errs = popt[row].reshape(n_peaks, PARS), perr[row].reshape(n_peaks, PARS)
+         pars[:, 2] = np.exp(pars[:, 2])
+         pars[:, 3] = 0.5*(1 + np.tanh(pars[:, 3]/2))
+         errs[:, 2] *= pars[:, 2]
+         errs[:, 3] *= pars[:, 3]*(1 - pars[:, 3])
+         results[ind] = (pars, errs)
+
+   return results
+
+####################################################################################
+### Lattice constants
+####################################################################################
+def read_scan(source, path):
+
+   data = source.loadtxt(path, ndmin=2)
+   return data[:, 0], data[:, 1]
+
+def sample_peaks(source, name, c=c_nominal, a=a_nominal):
+
+   # [(kind, hkl, fname, center, center_err, fwhm)] of all reflections found
+   # in the scans of one sample folder. Wide scans are searched for the
+   # (00l), l = 3n, reflections inside their angle range.
+   scans, labels = [], []
+   for kind, hkl, fname in scan_files(source, name):
+
+      x, y = read_scan(source, fname)
+      if kind == 'wide':
+         reflections = [(0, 0, l) for l in range(3, int(2*c/wavelength), 3)]
+         positions = [two_theta(d_spacing(refl, c, a)) for refl in reflections]
+      else:
+         # The scan is centered on its reflection
+         reflections = [hkl]
+         positions = [x[np.argmax(y)]]
+
+      centers = find_peaks(x, y, positions)
+      found = [refl for refl, pos in zip(reflections, positions)
+         if any(abs(center - pos) < window for center in centers)]
+
+      scans.append((x, y, centers))
+      labels.append((kind, found, fname))
+
+   peaks = []
+   for (kind, found, fname), result in zip(labels, fit_scans(scans)):
+      if result is None:
+         continue
+      pars, perr = result
+      for refl, par, err in zip(found, pars, perr):
+         if np.all(np.isfinite(par)) and abs(par[1] - two_theta(d_spacing(refl, c, a))) < 1:
+            peaks.append((kind, refl, fname, par[1], err[1], par[2]))
+   return peaks
+
+def _mean_err(vals):
+
+   # Mean and standard error of the mean (NaN for a single value)
+   if not vals:
+      return np.nan, np.nan
+   vals = np.array(vals)
+   err = np.std(vals, ddof=1)/np.sqrt(len(vals)) if len(vals) > 1 else np.nan
+   return np.mean(vals), err
+
+def _weighted_mean_err(vals, errs):
+
+   # Mean weighted by 1/errs**2 and its standard error from the weighted
+   # scatter (NaN for a single value); equal weights unless all errs are > 0
+   vals, errs = np.array(vals), np.array(errs)
+   if not np.all(errs > 0):
+      return _mean_err(list(vals))
+   w = 1/errs**2
+   mean = np.sum(w*vals)/np.sum(w)
+   if len(vals) < 2:
+      return mean, np.nan
+   return mean, np.sqrt(np.sum(w*(vals - mean)**2)/((len(vals) - 1)*np.sum(w)))
+
+def nelson_riley(tth):
+
+   theta = np.radians(np.asarray(tth))/2
+   return np.cos(theta)**2/np.sin(theta) + np.cos(theta)**2/theta
+
+def lattice_constants(peaks):
+
+   # c from the (00l) peaks, a from the others with that c.
+   # The 2theta/omega scans are aligned on their reflection, so c comes from
+   # them when there are any: a mean weighted by the error of c of every peak,
+   # c*cot(theta)*err(theta), which favours the high angle reflections.
+   # Otherwise the wide scans are used, extrapolated to theta = 90 deg
+   # (Nelson-Riley) against the sample displacement when they have 3 or more
+   # peaks. Returns (c, c_err, a, a_err), NaN if missing.
+   c_peaks = {'2q_w': [], 'wide': []}
+   hk_peaks = []
+   for kind, (h, k, l), fname, center, center_err, fwhm in peaks:
+      if h == 0 and k == 0:
+         c = l*d_from_two_theta(center)
+         c_peaks[kind].append((center, c, c*np.radians(center_err/2)/np.tan(np.radians(center/2))))
+      else:
+         hk_peaks.append(((h, k, l), center))
+
+   if c_peaks['2q_w']:
+      tth, vals, errs = np.array(c_peaks['2q_w']).transpose()
+      c, c_err = _weighted_mean_err(vals, errs)
+   elif len(c_peaks['wide']) >= 3:
+      tth, vals, errs = np.array(c_peaks['wide']).transpose()
+      (slope, c), cov = np.polyfit(nelson_riley(tth), vals, 1, cov=True)
+      c_err = np.sqrt(cov[1, 1])
+   else:
+      c, c_err = _mean_err([val for _, val, _ in c_peaks['wide']])
+   c_fit = c if np.isfinite(c) else c_nominal
+
+   a_vals = []
+   for (h, k, l), center in hk_peaks:
+      inv_a2 = (1/d_from_two_theta(center)**2 - l**2/c_fit**2)*3/(4*(h**2 + h*k + k**2))
+      if inv_a2 > 0:
+         a_vals.append(1/np.sqrt(inv_a2))
+   a, a_err = _mean_err(a_vals)
+
+   return c, c_err, a, a_err
+
+def sample_name(folder):
+
+   # Folders of one sample are named like 363-s1, 365_s, 366s
+   return re.match(r"\d+", folder).group()
+
+def lattice_table(data_root='data', samples=None):
+
+   # {sample: (c, c_err, a, a_err)} from the peaks of all folders of
+   # data_root, extracted or zipped, that belong to the sample
+   source = ArchiveSource(data_root)
+   folders = {}
+   for name in source.names():
+      folders.setdefault(sample_name(name), []).append(name)
+   if samples is None:
+      samples = list(folders)
+
+   return {sample: lattice_constants(sum((sample_peaks(source, name)
+      for name in folders.get(sample, [])), [])) for sample in samples}
+
+if __name__ == '__main__':
+
+   # Fitted (c, c_err, a, a_err) of every sample of data/, in the layout of
+   # the tuples of Fe_samples and SrFe_samples
+   for sample, (c, c_err, a, a_err) in sorted(lattice_table().items()):
+      print(f"'{sample}':\t(x, {c:.5f}, {c_err:.3g}, {a:.5f}, {a_err:.3g}),")
@@ -0,0 +1,111 @@
+import os
+import re
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Transport'))
+from archive_data import ArchiveSource
+from parallel import run_jobs
+from xrd_peaks import fit_scans, parse_hkl, read_scan, sample_name
+
+####################################################################################
+### Rocking curve files
+####################################################################################
+# Rocking curves are *_Rocking.txt, omega [deg] vs counts, named after the
+# reflection and the phi of the sample, e.g. 367_(205)_phi_200.9_Rocking.txt.
+# Files without phi (aligned (00l) scans) get phi = NaN.
+
+def parse_phi(fname):
+
+   match = re.search(r"_phi_(-?\d+(?:\.\d+)?)", fname)
+   return float(match.group(1)) if match else np.nan
+
+def rocking_files(source):
+
+   # [(folder, fname)] of all rocking curves of an ArchiveSource
+   return [(name, fname) for name in source.names() for fname in source.listdir(name)
+      if fname.endswith('_Rocking.txt') and parse_hkl(fname) is not None]
+
+####################################################################################
+### Fits
+####################################################################################
+def _rocking_job(job):
+
+   # One pseudo-Voigt over the whole scan of every file of the chunk, all
+   # files fitted in one batch
+   source, files = job
+   scans = []
+   for name, fname in files:
+      x, y = read_scan(source, f"{name}/{fname}")
+      scans.append((x, y, [x[np.argmax(y)]]))
+
+   rows = []
+   for (name, fname), (x, _, _), result in zip(files, scans, fit_scans(scans, half_width=np.inf)):
+      pars, perr = result
+      rows.append({
+         'sample': sample_name(name),
+         'folder': name,
+         'file': fname,
+         'hkl': parse_hkl(fname),
+         'phi': parse_phi(fname),
+         'center': pars[0, 1],
+         'center_err': perr[0, 1],
+         'fwhm': pars[0, 2],
+         'fwhm_err': perr[0, 2],
+         'eta': np.clip(pars[0, 3], 0, 1),
+         'scan_range': np.ptp(x),
+      })
+   return rows
+
+def rocking_table(data_root='data', n_workers=1, chunk_size=16):
+
+   # [row] with sample, folder, file, hkl, phi, center, fwhm (omega, deg),
+   # their errors, eta and the omega range of the scan for every rocking
+   # curve of data_root. Files are split into chunks of chunk_size, each
+   # fitted in one batch by a worker.
+   source = ArchiveSource(data_root)
+   files = rocking_files(source)
+   jobs = [(source, files[start:start + chunk_size])
+      for start in range(0, len(files), chunk_size)]
+
+   return [row for rows in run_jobs(_rocking_job, jobs, n_workers) for row in rows]
+
+def rocking_failed(row):
+
+   # Fits that did not find a peak: no width, a width beyond the scan or an
+   # error larger than the width
+   return not (np.isfinite(row['fwhm']) and row['fwhm'] <= row['scan_range']
+      and row['fwhm_err'] <= row['fwhm'])
+
+def rocking_summary(rows):
+
+   # ({(sample, hkl): (mean center, mean fwhm, fwhm spread, n files)}, [failed
+   # rows]) over the phi and the repeated scans of a reflection, the failed
+   # fits left out
+   groups, failed = {}, []
+   for row in rows:
+      if rocking_failed(row):
+         failed.append(row)
+      else:
+         groups.setdefault((row['sample'], row['hkl']), []).append(row)
+
+   summary = {}
+   for key, group in sorted(groups.items()):
+      fwhm = np.array([row['fwhm'] for row in group])
+      summary[key] = (np.mean([row['center'] for row in group]), np.mean(fwhm),
+         np.std(fwhm), len(group))
+   return summary, failed
+
+if __name__ == '__main__':
+
+   rows = rocking_table(n_workers=os.cpu_count())
+   summary, failed = rocking_summary(rows)
+   for (sample, hkl), (center, fwhm, spread, n) in summary.items():
+      print(f"{sample:>4} ({''.join(map(str, hkl))})  omega = {center:8.4f}  "
+         f"FWHM = {fwhm:.4f} +- {spread:.4f} deg  ({n} scans)")
+
+   print(f"{len(failed)} of {len(rows)} scans dropped as failed fits:")
+   for row in failed:
+      print(f"   {row['folder']}/{row['file']}: FWHM = {row['fwhm']:.3g} +- "
+         f"{row['fwhm_err']:.3g} deg over a {row['scan_range']:.3g} deg scan")
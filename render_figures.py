@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import runpy
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Figure scripts, relative to the repository root. Each one runs in its own
+# directory, where its data paths are relative to.
+SCRIPTS = [
+   os.path.join('Transport', 'SdH_main.py'),
+   os.path.join('Transport', 'Fe_transport.py'),
+   os.path.join('Magnetism', 'Fe_magnetism.py'),
+   os.path.join('X-ray', 'Fe_x-ray.py'),
+   os.path.join('X-ray', 'SrFe_x-ray.py'),
+]
+
+# Scripts that read what another one writes, script -> the script it waits
+# for. SdH_main.py stores mu_q in Transport/SdH_results.json, the mobility
+# panel of Fe_transport.py plots it. When the prerequisite is not among the
+# scripts of a run, the dependent script reads the results stored last.
+AFTER = {
+   os.path.join('Transport', 'Fe_transport.py'): os.path.join('Transport', 'SdH_main.py'),
+}
+
+##############################################################################################
+## Headless rendering
+##############################################################################################
+def render_script(script, out_dir, formats=('png', 'pdf')):
+
+   # Runs a figure script with the non-interactive Agg backend and saves
+   # every figure it leaves open. Meant to run in a fresh worker process.
+   os.environ['MPLBACKEND'] = 'Agg'
+   import matplotlib
+   matplotlib.use('Agg', force=True)
+   import matplotlib.pyplot as plt
+   plt.show = lambda *args, **kwargs: None
+
+   script_path = os.path.join(ROOT, script)
+   script_dir = os.path.dirname(script_path)
+   name = os.path.splitext(os.path.basename(script))[0]
+   report = {'script': script, 'figures': [], 'error': None}
+
+   start = time.perf_counter()
+   try:
+      os.chdir(script_dir)
+      sys.path.insert(0, script_dir)
+      runpy.run_path(script_path, run_name='__main__')
+   except Exception as exc:
+      report['error'] = f"{type(exc).__name__}: {exc}"
+   report['script_seconds'] = time.perf_counter() - start
+
+   # Figures of a failed script are incomplete and not saved
+   for num in plt.get_fignums() if report['error'] is None else []:
+
+      fig = plt.figure(num)
+      files = []
+      start = time.perf_counter()
+      for fmt in formats:
+         fname = os.path.join(out_dir, f"{name}_{num}.{fmt}")
+         fig.savefig(fname)
+         files.append(fname)
+
+      report['figures'].append({
+         'figure': num,
+         'files': files,
+         'render_seconds': time.perf_counter() - start,
+      })
+      plt.close(fig)
+
+   return report
+
+def render_all(scripts, out_dir, formats=('png', 'pdf'), n_workers=None):
+
+   # Every script in a separate, freshly spawned process. Scripts run in
+   # parallel, except that a script of AFTER starts once its prerequisite
+   # has finished; the reports keep the order of scripts.
+   out_dir = os.path.abspath(out_dir)
+   os.makedirs(out_dir, exist_ok=True)
+
+   context = multiprocessing.get_context('spawn')
+   with ProcessPoolExecutor(max_workers=n_workers, mp_context=context,
+         max_tasks_per_child=1) as pool:
+      futures = {}
+      for script in sorted(scripts, key=lambda script: script in AFTER):
+         if AFTER.get(script) in futures:
+            futures[AFTER[script]].result()
+         futures[script] = pool.submit(render_script, script, out_dir, formats)
+      return [futures[script].result() for script in scripts]
+
+if __name__ == '__main__':
+
+   parser = argparse.ArgumentParser(description="Render all figures without a display")
+   parser.add_argument('scripts', nargs='*', default=SCRIPTS)
+   parser.add_argument('--out-dir', default='figures')
+   parser.add_argument('--formats', nargs='+', default=['png', 'pdf'])
+   parser.add_argument('--workers', type=int, default=None)
+   parser.add_argument('--report', default=None, help="write the timings as JSON")
+   args = parser.parse_args()
+
+   reports = render_all(args.scripts, args.out_dir, args.formats, args.workers)
+
+   for report in reports:
+      status = report['error'] or 'ok'
+      print(f"{report['script']}: {report['script_seconds']:.2f} s ({status})")
+      for figure in report['figures']:
+         print(f"   figure {figure['figure']}: {figure['render_seconds']:.2f} s -> "
+            + ", ".join(os.path.basename(fname) for fname in figure['files']))
+
+   if args.report is not None:
+      with open(args.report, 'w') as f:
+         json.dump(reports, f, indent=2)